@@ -2,13 +2,12 @@
 import socket
 import sys
 
-from async import poll
+from async import Poll
 from Channel import Channel
+from Datagram import DatagramSocket
+from Shared import EndPointEvents
 
-class EndPoint(Channel):
-	"""
-	The endpoint queues up all network events for other classes to read.
-	"""
+class EndPoint(EndPointEvents, Channel):
 	def __init__(self, address=("127.0.0.1", 31425), map=None):
 		self.address = address
 		self.isConnected = False
@@ -31,36 +30,20 @@ class EndPoint(Channel):
 		except socket.error, e:
 			self.queue.append({"action": "error", "error": e.args})
 	
-	def GetQueue(self):
-		return self.queue
+	def OpenDatagrams(self):
+		return DatagramSocket(('', 0), self.DatagramReceived, self._map)
 	
 	def Pump(self):
 		Channel.Pump(self)
 		self.queue = []
-		poll(map=self._map)
-	
-	# methods to add network data to the queue depending on network events
+		self.PumpDatagrams()
+		Poll(map=self._map)
 	
 	def Close(self):
 		self.isConnected = False
 		self.close()
+		self.CloseDatagrams()
 		self.queue.append({"action": "disconnected"})
-	
-	def Connected(self):
-		self.queue.append({"action": "socketConnect"})
-	
-	def Network_connected(self, data):
-		self.isConnected = True
-	
-	def Network(self, data):
-		self.queue.append(data)
-	
-	def Error(self, error):
-		self.queue.append({"action": "error", "error": error})
-	
-	def ConnectionError(self):
-		self.isConnected = False
-		self.queue.append({"action": "error", "error": (-1, "Connection error")})
 
 if __name__ == "__main__":
 	import unittest
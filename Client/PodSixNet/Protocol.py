@@ -0,0 +1,353 @@
+"""
+PodSixNet on asyncio (trollius on Python 2) instead of asyncore/asynchat.
+
+Channel, Server and EndPoint keep the interface of the asyncore classes: the same Network_ callbacks, framing, state lane and UDP datagrams, and Pump() still runs one pass of the network for existing game loops. Instead of Pump() and sleep(), a game can Schedule() its tick on the event loop and Run() it.
+
+Reads go into one growing buffer (get_buffer/buffer_updated, as with asyncio's BufferedProtocol) which is parsed in place. Writes are gathered until the current callback is done and go to the transport together, and the pending state is written once the transport's buffer has drained.
+"""
+import socket
+from time import time
+
+try:
+	import asyncio
+except ImportError:
+	import trollius as asyncio
+
+from rencode import loads
+from Shared import ChannelGroup, EndPointEvents, Messages
+
+class Channel(Messages, asyncio.Protocol):
+	def __init__(self, conn=None, addr=(), server=None, map=None):
+		Messages.__init__(self, server)
+		self.addr = addr
+		self.transport = None
+		self.writing = True
+		if server is not None:
+			self.loop = server.loop
+		# written together by Flush() once the current callback is done
+		self.outgoing = []
+
+	def connection_made(self, transport):
+		self.transport = transport
+		self.addr = transport.get_extra_info('peername')
+		sock = transport.get_extra_info('socket')
+		if sock is not None:
+			sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		# pause as soon as anything is buffered, so resume_writing() says when it has all been written
+		transport.set_write_buffer_limits(high=0, low=0)
+		if self._server:
+			self._server.Accepted(self, self.addr)
+		elif hasattr(self, "Connected"):
+			self.Connected()
+		if self.outgoing:
+			self.Flush()
+
+	def get_buffer(self, sizehint=-1):
+		if len(self._rbuffer) - self._rend < max(sizehint, 4096):
+			self._rbuffer.extend(bytearray(max(sizehint, len(self._rbuffer))))
+		return memoryview(self._rbuffer)[self._rend:]
+
+	def buffer_updated(self, nbytes):
+		self._rend += nbytes
+		self.ReadMessages()
+
+	def data_received(self, data):
+		# without BufferedProtocol, copy into the same buffer
+		self.get_buffer(len(data))
+		self._rbuffer[self._rend:self._rend + len(data)] = data
+		self.buffer_updated(len(data))
+
+	def ReadMessages(self):
+		"""Dispatches the terminated messages in the receive buffer until the other end switches to length prefixed frames."""
+		buf = self._rbuffer
+		start = 0
+		while not self.framedRecv:
+			end = buf.find(self.endchars, start, self._rend)
+			if end < 0:
+				break
+			message = str(buf[start:end])
+			start = end + len(self.endchars)
+			self.Dispatch(loads(message))
+		if start:
+			buf[:self._rend - start] = buf[start:self._rend]
+			self._rend -= start
+		if self.framedRecv:
+			self.ReadFrames()
+
+	def connection_lost(self, exc):
+		self.ForgetDatagrams()
+		if self._server and self in self._server.channels:
+			self._server.channels.remove(self)
+		if hasattr(self, "Close"):
+			self.Close()
+
+	def pause_writing(self):
+		self.writing = False
+
+	def resume_writing(self):
+		self.writing = True
+		if self.sendstate is not None:
+			outgoing = self.sendstate
+			self.sendstate = None
+			self.Write(outgoing)
+
+	def Pump(self):
+		pass
+
+	def Write(self, outgoing):
+		if not self.outgoing:
+			self.loop.call_soon(self.Flush)
+		self.outgoing.append(outgoing)
+
+	def Flush(self):
+		"""Writes everything sent since the last Flush() to the transport at once, so it leaves in as few send() calls and packets as possible."""
+		if self.outgoing and self.transport:
+			self.transport.write("".join(self.outgoing))
+			self.outgoing = []
+
+	def SendEncoded(self, outgoing):
+		"""Queues data which is already encoded and terminated, such as a broadcast from Server.SendToAll, to be written at the end of the current callback. Returns the number of bytes."""
+		# state from before this event is out of date
+		self.sendstate = None
+		self.Write(outgoing)
+		return len(outgoing)
+
+	def QueueState(self, outgoing):
+		if self.writing:
+			self.Write(outgoing)
+		else:
+			self.sendstate = outgoing
+
+	def Backlog(self):
+		"""Returns the number of bytes written but not yet sent on the socket, not counting the pending state."""
+		queued = sum([len(d) for d in self.outgoing])
+		if self.transport:
+			return queued + self.transport.get_write_buffer_size()
+		return queued
+
+	def close(self):
+		if self.transport:
+			self.transport.close()
+
+class DatagramProtocol(asyncio.DatagramProtocol):
+	"""
+	The asyncio version of Datagram.DatagramSocket, which hands every datagram to receiver(data, addr).
+	"""
+	def __init__(self, receiver, loop=None):
+		self.receiver = receiver
+		self.loop = loop
+		self.transport = None
+		self.impairment = None
+
+	def connection_made(self, transport):
+		self.transport = transport
+
+	def datagram_received(self, data, addr):
+		self.receiver(data, addr)
+
+	def error_received(self, exc):
+		pass
+
+	def getsockname(self):
+		return self.transport.get_extra_info('sockname')
+
+	def SendTo(self, data, addr):
+		if self.impairment:
+			# the loop pumps the impairment when the datagram is due, so nothing polls it in between
+			due = self.impairment.Send(self.RawSendTo, data, addr)
+			if due is not None and self.loop:
+				self.loop.call_later(max(0, due - time()), self.Pump)
+		else:
+			self.RawSendTo(data, addr)
+
+	def RawSendTo(self, data, addr):
+		if self.transport:
+			self.transport.sendto(data, addr)
+
+	def Pump(self):
+		if self.impairment:
+			self.impairment.Pump(self.RawSendTo)
+
+	def close(self):
+		if self.transport:
+			self.transport.close()
+
+def RunOnce(loop):
+	"""Runs the callbacks which are ready, and handles the sockets which are ready, without waiting."""
+	loop.call_soon(loop.stop)
+	loop.run_forever()
+
+class Server(ChannelGroup):
+	channelClass = Channel
+
+	def __init__(self, channelClass=None, localaddr=("127.0.0.1", 31425), listeners=5, loop=None):
+		if channelClass:
+			self.channelClass = channelClass
+		self.loop = loop or asyncio.get_event_loop()
+		self.channels = []
+		self.datagrams = None
+		self.datagramChannels = {}
+		host, port = localaddr
+		# IPv4 only, like the asyncore Server
+		self.server = self.loop.run_until_complete(self.loop.create_server(self.NewChannel, host or "0.0.0.0", port, backlog=listeners, reuse_address=True))
+		self.address = self.server.sockets[0].getsockname()
+		if self.offerDatagrams:
+			transport, self.datagrams = self.loop.run_until_complete(self.loop.create_datagram_endpoint(lambda: DatagramProtocol(self.ReceiveDatagram, self.loop), local_addr=self.address))
+
+	def NewChannel(self):
+		return self.channelClass(server=self)
+
+	def Schedule(self, function, interval, catchup=1):
+		"""Calls function every interval seconds on the event loop, on a fixed schedule which does not drift with the time function takes. When the loop falls behind, up to catchup calls are made at once and the rest are skipped."""
+		loop = self.loop
+		def tick(due):
+			for calls in xrange(catchup):
+				function()
+				due += interval
+				if due > loop.time():
+					break
+			else:
+				due = loop.time() + interval
+			loop.call_at(due, tick, due)
+		loop.call_soon(tick, loop.time())
+	
+	def Pump(self):
+		if self.datagrams:
+			self.datagrams.Pump()
+		RunOnce(self.loop)
+
+	def Run(self):
+		"""Runs the event loop until Stop() is called."""
+		self.loop.run_forever()
+
+	def Stop(self):
+		self.loop.stop()
+
+	def close(self):
+		for c in list(self.channels):
+			c.close()
+		if self.datagrams:
+			self.datagrams.close()
+		self.server.close()
+		RunOnce(self.loop)
+
+class EndPoint(EndPointEvents, Channel):
+	def __init__(self, address=("127.0.0.1", 31425), loop=None):
+		Channel.__init__(self)
+		self.address = address
+		self.isConnected = False
+		self.queue = []
+		self.loop = loop or asyncio.get_event_loop()
+
+	def DoConnect(self, address=None):
+		if address:
+			self.address = address
+		host, port = self.address
+		connecting = asyncio.ensure_future(self.loop.create_connection(lambda: self, host, port), loop=self.loop)
+		connecting.add_done_callback(self.ConnectDone)
+
+	def ConnectDone(self, future):
+		if future.cancelled():
+			return
+		error = future.exception()
+		if error is not None:
+			self.queue.append({"action": "error", "error": getattr(error, 'args', error)})
+
+	def OpenDatagrams(self):
+		# called from a message while the loop is running, so the socket opens on a later pass and the hello waits until then
+		protocol = DatagramProtocol(self.DatagramReceived, self.loop)
+		asyncio.ensure_future(self.loop.create_datagram_endpoint(lambda: protocol, local_addr=('0.0.0.0', 0)), loop=self.loop)
+		return protocol
+
+	def Pump(self):
+		self.queue = []
+		self.PumpDatagrams()
+		RunOnce(self.loop)
+
+	def Close(self):
+		self.isConnected = False
+		self.close()
+		self.CloseDatagrams()
+		self.queue.append({"action": "disconnected"})
+
+#########################
+#	Test stub	#
+#########################
+
+if __name__ == "__main__":
+	import unittest
+	from time import sleep, time
+	
+	class ProtocolTestCase(unittest.TestCase):
+		testdata = {"action": "hello", "data": {"a": 321, "b": [2, 3, 4], "c": ["afw", "wafF", "aa", "weEEW", "w234r"], "d": ["x"] * 256}}
+		def setUp(self):
+			class ServerChannel(Channel):
+				def Network_hello(self, data):
+					self._server.received.append(data)
+			
+			class TestServer(Server):
+				offerFraming = True
+				offerDatagrams = True
+				channel = None
+				def Connected(self, channel, addr):
+					self.channel = channel
+					self.received = []
+			
+			class TestEndPoint(EndPoint):
+				acceptFraming = True
+				acceptDatagrams = True
+				states = []
+				def Network_state(self, data):
+					self.states.append(data['tick'])
+			
+			self.server = TestServer(channelClass=ServerChannel, localaddr=("127.0.0.1", 31427))
+			self.endpoint = TestEndPoint(("127.0.0.1", 31427))
+		
+		def Pump(self, seconds):
+			start = time()
+			while time() - start < seconds:
+				self.server.Pump()
+				self.endpoint.Pump()
+				sleep(0.001)
+		
+		def runTest(self):
+			self.endpoint.DoConnect()
+			self.Pump(0.3)
+			channel = self.server.channel
+			self.failUnless(self.endpoint.isConnected, "Endpoint is not connected")
+			self.failUnless(channel.framedSend and self.endpoint.framedSend, "Framing was not agreed")
+			self.failUnless(channel.datagramAddr and self.endpoint.datagramAddr, "UDP was not set up")
+			
+			for x in range(3):
+				self.endpoint.Send(self.testdata)
+			self.Pump(0.1)
+			self.failUnless(self.server.received == [self.testdata] * 3, "Messages were lost on the way")
+			
+			for tick in range(1, 11):
+				self.server.SendToAll({"action": "state", "tick": tick}, state=True)
+				self.Pump(0.005)
+			self.Pump(0.1)
+			states = self.endpoint.states
+			self.failUnless(states and states == sorted(set(states)) and states[-1] == 10, "States were not delivered in order")
+			
+			# delayed datagrams are sent by the loop when they are due, without Pump()
+			from Shared import Impairment
+			self.server.datagrams.impairment = Impairment(delay=0.02)
+			self.server.SendToAll({"action": "state", "tick": 11}, state=True)
+			loop = self.server.loop
+			loop.run_until_complete(asyncio.sleep(0.1, loop=loop))
+			self.endpoint.Pump()
+			self.failUnless(states[-1] == 11, "Delayed datagrams were not sent")
+			self.server.datagrams.impairment = None
+			
+			self.endpoint.Close()
+			self.Pump(0.1)
+			self.failUnless(self.server.channels == [], "Server did not notice the disconnect")
+		
+		def tearDown(self):
+			self.endpoint.Close()
+			self.server.close()
+			del self.server
+			del self.endpoint
+	
+	unittest.main()
@@ -1,23 +1,34 @@
 import socket
 import sys
 
-from async import poll, asyncore
+from async import Poll, SelectorMap, selectors, asyncore
 from Channel import Channel
+from Datagram import DatagramSocket
+from Shared import ChannelGroup
 
-class Server(asyncore.dispatcher):
+class Server(ChannelGroup, asyncore.dispatcher):
 	channelClass = Channel
 	
 	def __init__(self, channelClass=None, localaddr=("127.0.0.1", 31425), listeners=5):
 		if channelClass:
 			self.channelClass = channelClass
-		self._map = {}
+		if selectors:
+			self._map = SelectorMap()
+		else:
+			self._map = {}
 		self.channels = []
+		# channels with output waiting for the next Pump(), added by Channel.Queued()
+		self.pending = []
 		asyncore.dispatcher.__init__(self, map=self._map)
 		self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
 		self.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 		self.set_reuse_addr()
 		self.bind(localaddr)
 		self.listen(listeners)
+		self.datagrams = None
+		self.datagramChannels = {}
+		if self.offerDatagrams:
+			self.datagrams = DatagramSocket(self.socket.getsockname(), self.ReceiveDatagram, self._map)
 	
 	def handle_accept(self):
 		try:
@@ -29,14 +40,26 @@ class Server(asyncore.dispatcher):
 			print 'warning: server accept() threw EWOULDBLOCK'
 			return
 		
-		self.channels.append(self.channelClass(conn, addr, self, self._map))
-		self.channels[-1].Send({"action": "connected"})
-		if hasattr(self, "Connected"):
-			self.Connected(self.channels[-1], addr)
+		self.Accepted(self.channelClass(conn, addr, self, self._map), addr)
 	
-	def Pump(self):
-		[c.Pump() for c in self.channels]
-		poll(map=self._map)
+	def Flush(self):
+		"""Writes the output each channel queued since the last Flush(), with one push per channel."""
+		pending = self.pending
+		self.pending = []
+		for c in pending:
+			c.queued = False
+			c.Pump()
+			if c.sendstate is not None:
+				# the state waits until the events before it are written
+				c.Queued()
+	
+	def Pump(self, flush=True):
+		"""Writes the queued output, and handles the sockets which are ready. A game which calls Flush() itself once per tick can pass flush=False, so everything a channel sends in a tick goes out together."""
+		if flush:
+			self.Flush()
+		if self.datagrams:
+			self.datagrams.Pump()
+		Poll(map=self._map)
 
 #########################
 #	Test stub	#
@@ -0,0 +1,306 @@
+"""
+The parts of PodSixNet shared by the asyncore classes and the asyncio ones in Protocol.py: message dispatch and framing, greeting and broadcasting, the endpoint event queue, and the datagram header. Nothing here imports asyncore or asynchat, so Protocol.py loads without them.
+"""
+from heapq import heappop, heappush
+from random import Random, getrandbits
+from struct import pack, unpack_from
+from time import time
+
+from rencode import loads, dumps
+
+HEADER = '!II'
+HEADER_SIZE = 8
+
+class Impairment:
+	"""
+	Drops and delays outgoing datagrams, to test over loopback as if over a bad network. Set it as the impairment of a DatagramSocket or a Protocol.DatagramProtocol.
+	"""
+	def __init__(self, loss=0.0, delay=0.0, jitter=0.0, seed=None):
+		self.loss = loss
+		self.delay = delay
+		self.jitter = jitter
+		self.random = Random(seed)
+		self.pending = []
+		self.count = 0
+
+	def Send(self, sendto, data, addr):
+		"""Holds a datagram back until it is due, or drops it. Returns the time() it is due at, or None when it was dropped."""
+		if self.random.random() < self.loss:
+			return None
+		due = time() + self.delay + self.random.uniform(0, self.jitter)
+		self.count += 1
+		heappush(self.pending, (due, self.count, data, addr))
+		return due
+
+	def Pump(self, sendto):
+		"""Sends the delayed datagrams which are due."""
+		now = time()
+		while self.pending and self.pending[0][0] <= now:
+			due, count, data, addr = heappop(self.pending)
+			sendto(data, addr)
+
+def Header(token, sequence):
+	return pack(HEADER, token, sequence)
+
+def ReadHeader(data):
+	"""Returns the token, sequence number and payload of a datagram, or None if it is too short."""
+	if len(data) < HEADER_SIZE:
+		return None
+	token, sequence = unpack_from(HEADER, data)
+	return token, sequence, data[HEADER_SIZE:]
+
+# names of the Network_ methods of each class which dispatches messages
+handlerNames = {}
+
+def Handlers(obj):
+	"""Returns the Network_ methods of obj bound to it by action, and its catch-all Network method or None. The names are looked up once per class, so handlers added to an instance after its first message are not seen."""
+	cls = obj.__class__
+	if cls not in handlerNames:
+		handlerNames[cls] = [n for n in dir(cls) if n.startswith('Network_')]
+	table = dict([(n[len('Network_'):], getattr(obj, n)) for n in handlerNames[cls]])
+	return table, getattr(obj, 'Network', None)
+
+class Messages:
+	"""
+	Encoding, framing and dispatch of messages, shared by the asyncore Channel and the asyncio one in Protocol.py. A subclass writes the bytes: SendEncoded() for events and QueueState() for the state lane.
+	
+	Messages go out in two lanes. Send() queues events, which are delivered reliably and in order. SendState() keeps only the newest state message, which is written once everything queued before it has left, so a slow connection gets the latest state instead of a backlog. An event sent after a pending state replaces it as well.
+	
+	When both ends agree (see Server.offerDatagrams and EndPoint.acceptDatagrams), state messages go over UDP instead, and only the newest one received is dispatched.
+	
+	Messages are separated by endchars by default. Either end can offer length prefixed frames instead (see Server.offerFraming and EndPoint.acceptFraming), which are read straight into a buffer without searching for a terminator, and whose strings are not base64 encoded.
+	"""
+	endchars = '\0---\0'
+	# larger state messages go over TCP even when UDP is set up
+	maxDatagram = 4096
+	# built by the first Dispatch()
+	networkHandlers = None
+	networkCatchAll = None
+	unknownActions = None
+	def __init__(self, server=None):
+		self._server = server
+		self.sendstate = None
+		self.framedSend = False
+		self.framedRecv = False
+		self._rbuffer = bytearray(65536)
+		self._rend = 0
+		self.datagrams = None
+		self.datagramAddr = None
+		self.datagramToken = None
+		self.datagramSent = 0
+		self.datagramSeen = 0
+	
+	def Dispatch(self, data):
+		"""Calls Network() and then the Network_ method of the action of data. Messages which neither handles are counted in unknownActions by action, or under None when they have no action at all."""
+		if self.networkHandlers is None:
+			self.networkHandlers, self.networkCatchAll = Handlers(self)
+			self.unknownActions = {}
+		try:
+			handler = self.networkHandlers.get(data['action'])
+		except (TypeError, KeyError):
+			self.unknownActions[None] = self.unknownActions.get(None, 0) + 1
+			return
+		if self.networkCatchAll is not None:
+			self.networkCatchAll(data)
+		if handler is not None:
+			handler(data)
+		elif self.networkCatchAll is None:
+			self.unknownActions[data['action']] = self.unknownActions.get(data['action'], 0) + 1
+	
+	def ReadFrames(self):
+		"""Dispatches every complete length prefixed frame in the receive buffer."""
+		buf = self._rbuffer
+		view = memoryview(buf)
+		start, end = 0, self._rend
+		while end - start >= 4:
+			length = unpack_from('!I', buf, start)[0]
+			if end - start - 4 < length:
+				break
+			start += 4
+			frame = view[start:start + length]
+			start += length
+			self.Dispatch(loads(frame))
+		del view
+		
+		# keep the partial frame at the start of the buffer
+		if start:
+			buf[:end - start] = buf[start:end]
+			self._rend = end - start
+	
+	def Encode(self, data):
+		"""Returns data encoded and framed for the other end of this channel."""
+		if self.framedSend:
+			outgoing = dumps(data, b64=False)
+			return pack('!I', len(outgoing)) + outgoing
+		return dumps(data) + self.endchars
+	
+	def Send(self, data):
+		"""Returns the number of bytes sent after enoding."""
+		return self.SendEncoded(self.Encode(data))
+	
+	def EncodeState(self, data):
+		"""Returns data encoded for the state lane of this channel, which is a bare datagram payload when state goes over UDP."""
+		if self.datagramAddr:
+			return dumps(data, b64=False)
+		return self.Encode(data)
+	
+	def SendState(self, data):
+		"""Replaces the pending state message with data. Returns the number of bytes after encoding."""
+		return self.SendEncodedState(self.EncodeState(data))
+	
+	def SendEncodedState(self, outgoing):
+		"""Replaces the pending state message with data which is already encoded by EncodeState, or sends it as a datagram straight away. Returns the number of bytes."""
+		if self.datagramAddr:
+			if len(outgoing) <= self.maxDatagram:
+				self.datagramSent += 1
+				self.datagrams.SendTo(Header(self.datagramToken, self.datagramSent) + outgoing, self.datagramAddr)
+				return len(outgoing)
+			# too big for one datagram, so it goes over TCP after all
+			outgoing = self.Encode(loads(outgoing))
+		self.QueueState(outgoing)
+		return len(outgoing)
+	
+	def ReceiveDatagram(self, sequence, payload):
+		"""Dispatches the message of a datagram, unless a newer one has already arrived."""
+		if sequence <= self.datagramSeen:
+			return
+		self.datagramSeen = sequence
+		self.Dispatch(loads(payload))
+	
+	def Network_framing(self, data):
+		"""The other end asked for length prefixed frames, or acknowledged our request. Everything it sends after this message is length prefixed."""
+		if data.get('framing') != 'length':
+			return
+		self.framedRecv = True
+		if not self.framedSend:
+			# acknowledge in the old framing, then switch
+			self.Send({"action": "framing", "framing": "length"})
+			self.framedSend = True
+	
+	def ForgetDatagrams(self):
+		if self.datagramToken is not None and self._server:
+			self._server.datagramChannels.pop(self.datagramToken, None)
+
+class ChannelGroup:
+	"""
+	Greeting and broadcasting to the channels of a server, shared by the asyncore Server and the asyncio one in Protocol.py.
+	"""
+	# offer length prefixed frames to clients which accept them
+	offerFraming = False
+	# offer clients which accept it to send state messages over UDP, on the same port number as TCP
+	offerDatagrams = False
+	
+	def Accepted(self, channel, addr):
+		self.channels.append(channel)
+		if self.offerFraming:
+			channel.Send({"action": "connected", "framing": "length"})
+		else:
+			channel.Send({"action": "connected"})
+		if self.datagrams:
+			self.OfferDatagrams(channel)
+		if hasattr(self, "Connected"):
+			self.Connected(channel, addr)
+	
+	def OfferDatagrams(self, channel):
+		"""Gives the channel a token to put in its datagrams, which the other end starts sending once it has opened its UDP socket."""
+		token = getrandbits(32)
+		while token in self.datagramChannels:
+			token = getrandbits(32)
+		self.datagramChannels[token] = channel
+		channel.datagrams = self.datagrams
+		channel.datagramToken = token
+		channel.Send({"action": "datagram", "port": self.datagrams.getsockname()[1], "token": token})
+	
+	def ReceiveDatagram(self, data, addr):
+		header = ReadHeader(data)
+		if header is None:
+			return
+		token, sequence, payload = header
+		channel = self.datagramChannels.get(token)
+		if channel is None:
+			return
+		if channel.datagramAddr != addr:
+			# the first datagram from the other end says where to send ours
+			channel.datagramAddr = addr
+			channel.Send({"action": "datagram", "ready": True})
+		if payload:
+			channel.ReceiveDatagram(sequence, payload)
+	
+	def SendToAll(self, data, channels=None, state=False):
+		"""Encodes data once per framing mode and queues the same bytes on every channel (all of them by default), as their pending state if state is set. Returns the total number of bytes queued."""
+		if channels is None:
+			channels = self.channels
+		encoded = {}
+		total = 0
+		for c in channels:
+			if state:
+				mode = (c.datagramAddr is not None, c.framedSend)
+				if mode not in encoded:
+					encoded[mode] = c.EncodeState(data)
+				total += c.SendEncodedState(encoded[mode])
+			else:
+				if c.framedSend not in encoded:
+					encoded[c.framedSend] = c.Encode(data)
+				total += c.SendEncoded(encoded[c.framedSend])
+		return total
+
+class EndPointEvents:
+	"""
+	The endpoint queues up all network events for other classes to read. Shared by the asyncore EndPoint and the asyncio one in Protocol.py.
+	"""
+	# ask for length prefixed frames when the server offers them
+	acceptFraming = False
+	# take state messages over UDP when the server offers it
+	acceptDatagrams = False
+	
+	def GetQueue(self):
+		return self.queue
+	
+	def PumpDatagrams(self):
+		if self.datagrams:
+			if self.datagramAddr is None:
+				# keep saying hello until the server knows our address
+				self.datagrams.SendTo(Header(self.datagramToken, 0), self.datagramServer)
+			self.datagrams.Pump()
+	
+	def CloseDatagrams(self):
+		if self.datagrams:
+			self.datagrams.close()
+			self.datagrams = None
+	
+	# methods to add network data to the queue depending on network events
+	
+	def Connected(self):
+		self.queue.append({"action": "socketConnect"})
+	
+	def Network_connected(self, data):
+		self.isConnected = True
+		if self.acceptFraming and data.get('framing') == 'length':
+			self.Send({"action": "framing", "framing": "length"})
+			self.framedSend = True
+	
+	def Network_datagram(self, data):
+		if 'token' in data and self.acceptDatagrams:
+			self.datagramToken = data['token']
+			self.datagramServer = (self.address[0], data['port'])
+			self.datagrams = self.OpenDatagrams()
+		elif data.get('ready') and self.datagrams:
+			self.datagramAddr = self.datagramServer
+	
+	def DatagramReceived(self, data, addr):
+		header = ReadHeader(data)
+		if header is None:
+			return
+		token, sequence, payload = header
+		if token == self.datagramToken and payload:
+			self.ReceiveDatagram(sequence, payload)
+	
+	def Network(self, data):
+		self.queue.append(data)
+	
+	def Error(self, error):
+		self.queue.append({"action": "error", "error": error})
+	
+	def ConnectionError(self):
+		self.isConnected = False
+		self.queue.append({"action": "error", "error": (-1, "Connection error")})
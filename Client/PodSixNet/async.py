@@ -18,3 +18,81 @@ if float(version[:3]) < 2.6:
 		asyncore.dispatcher.__init__ (self, sock=conn, map=map)
 	asynchat.async_chat.__init__ = asynchat_monkey_init
 
+
+# selectors is in the standard library from Python 3.4, and trollius carries a copy for Python 2
+try:
+	import selectors
+except ImportError:
+	try:
+		from trollius import selectors
+	except ImportError:
+		selectors = None
+
+class SelectorMap(dict):
+	""" A socket map which keeps its sockets registered with a selector (epoll on Linux) instead of building select() sets on every poll, so an idle poll does not cost a call per socket and there is no limit of 1024 descriptors. Sockets are registered when asyncore adds them to the map, and their write interest is only checked again after they have written, or after Changed() when output was queued. """
+	def __init__(self):
+		dict.__init__(self)
+		self.selector = selectors.DefaultSelector()
+		self.events = {}
+		# sockets whose interest has to be checked before the next poll
+		self.changed = set()
+	
+	def __setitem__(self, fd, obj):
+		dict.__setitem__(self, fd, obj)
+		# the dispatcher is not done initialising yet, so look at it in the next poll
+		self.changed.add(fd)
+	
+	def __delitem__(self, fd):
+		dict.__delitem__(self, fd)
+		self.changed.discard(fd)
+		if self.events.pop(fd, 0):
+			self.selector.unregister(fd)
+	
+	def Changed(self, obj):
+		if obj._fileno in self:
+			self.changed.add(obj._fileno)
+	
+	def Update(self, fd):
+		obj = self[fd]
+		events = 0
+		if obj.readable():
+			events |= selectors.EVENT_READ
+		# accepting sockets should not be writable
+		if obj.writable() and not obj.accepting:
+			events |= selectors.EVENT_WRITE
+		old = self.events.get(fd, 0)
+		if events == old:
+			return
+		if not old:
+			self.selector.register(fd, events)
+		elif not events:
+			self.selector.unregister(fd)
+		else:
+			self.selector.modify(fd, events)
+		self.events[fd] = events
+	
+	def poll(self, timeout=0.0):
+		for fd in self.changed:
+			if fd in self:
+				self.Update(fd)
+		self.changed = set()
+		if not self.events:
+			return
+		for key, events in self.selector.select(timeout):
+			obj = self.get(key.fd)
+			if obj is None:
+				continue
+			if events & selectors.EVENT_READ:
+				asyncore.read(obj)
+			# only writing can take away pending output, anything which adds some calls Changed()
+			if events & selectors.EVENT_WRITE and key.fd in self:
+				asyncore.write(obj)
+				if key.fd in self:
+					self.Update(key.fd)
+
+def Poll(timeout=0.0, map=None):
+	""" Polls the sockets of map with its selector when it is a SelectorMap, otherwise with asyncore. """
+	if isinstance(map, SelectorMap):
+		map.poll(timeout)
+	else:
+		poll(timeout, map)
@@ -10,6 +10,7 @@ from kivy.clock import Clock
 from kivy.properties import NumericProperty, StringProperty
 
 from starfield import Starfield
+from codec import PACKED, unpack_updates
 
 from PodSixNet.Connection import connection
 from PodSixNet.Connection import ConnectionListener
@@ -22,6 +23,11 @@ DEBUG = False
 HOST = '127.0.0.1'
 PORT = 34002
 
+# Use length prefixed messages, and UDP for updates, when the server offers
+# them.
+connection.acceptFraming = True
+connection.acceptDatagrams = True
+
 class DogfightGame(FloatLayout, ConnectionListener):
     def __init__(self, *kargs, **kwargs):
         FloatLayout.__init__(self, *kargs, **kwargs)
@@ -68,6 +74,21 @@ class DogfightGame(FloatLayout, ConnectionListener):
         self.objects = {}
         self.player_id = None
         
+        # Snapshots received from the server, by tick.
+        self.snapshots = {}
+        
+        # Weapons flown by the client, and their remaining life time.
+        self.flights = {}
+        
+        # The last record applied to each object.
+        self.records = {}
+        
+        # Tick of the newest update, and the objects the server deleted with
+        # the last tick of the updates that may still hold them. Updates over
+        # UDP can arrive late, after newer ones or a delete.
+        self.tick = None
+        self.deleted = {}
+        
         
         # Debug Object
         if DEBUG:
@@ -90,8 +111,82 @@ class DogfightGame(FloatLayout, ConnectionListener):
         
     def Network_update(self, data):
         "Server says these objects need updates"
-        for u in data['updates']:
-            self.update_object(u)
+        tick = data['tick']
+        if self.tick is not None and tick <= self.tick:
+            return
+        self.tick = tick
+        
+        # Updates up to this tick are ignored from now on, so they can no
+        # longer bring back what was deleted.
+        deleted = self.deleted
+        for object_id in [i for i in deleted if deleted[i] <= tick]:
+            del deleted[object_id]
+        
+        if 'packed' in data:
+            updates = unpack_updates(data['packed'])
+        else:
+            updates = data['updates']
+        
+        if 'base' not in data:
+            for u in updates:
+                self.update_object(u)
+            return
+        
+        # Delta update, apply it to a copy of the snapshot it is based on.
+        base = data['base']
+        if base is None:
+            snapshot = {}
+        elif base in self.snapshots:
+            snapshot = dict(self.snapshots[base])
+        else:
+            # Already dropped, the server will send a newer delta.
+            return
+        
+        for u in updates:
+            object_id = u['object_id']
+            if object_id in snapshot:
+                record = dict(snapshot[object_id])
+                record.update(u)
+            else:
+                record = u
+            snapshot[object_id] = record
+            
+            # The server sends the same record again until this snapshot is
+            # acknowledged, applying it again would move the object back.
+            if self.records.get(object_id) != record:
+                self.records[object_id] = record
+                self.update_object(record)
+        
+        for object_id in data['removed']:
+            snapshot.pop(object_id, None)
+            self.remove_object(object_id)
+        
+        # A full snapshot replaces everything that was on screen, except
+        # the weapons in flight which are never part of it.
+        if base is None:
+            flights = self.flights
+            for object_id in [i for i in self.objects
+                              if i not in snapshot and i not in flights]:
+                self.remove_object(object_id)
+        
+        # Snapshots older than the base will not be used again.
+        self.snapshots[tick] = snapshot
+        if base is not None:
+            for old in [t for t in self.snapshots if t < base]:
+                del self.snapshots[old]
+        
+        self.send_action({'action': 'ack', 'tick': tick})
+    
+    def Network_spawn(self, data):
+        "Server says weapons were fired, fly them from where they are now."
+        for spawn in data['spawns']:
+            age = spawn['age']
+            record = dict(spawn)
+            record['pos_x'] += spawn['vel_x'] * age
+            record['pos_y'] += spawn['vel_y'] * age
+            record['vel_angle'] = 0
+            self.update_object(record)
+            self.flights[spawn['object_id']] = spawn['life_time'] - age
     
     def Network_player(self, data):
         "Response from server giving player data"
@@ -104,6 +199,9 @@ class DogfightGame(FloatLayout, ConnectionListener):
     
     def Network_delete(self, data):
         "Server says an object was removed"
+        tick = data['tick']
+        if self.tick is None or tick > self.tick:
+            self.deleted[data['object_id']] = tick
         self.remove_object(data['object_id'])
     
     def Network(self, data):
@@ -114,8 +212,8 @@ class DogfightGame(FloatLayout, ConnectionListener):
     # Game Logic
     def update(self, delta_time):
         "Update all the objects on the screen"
-        # Send any new controls to the server.
-        self.send_action({'action': 'player'})
+        # Send any new controls to the server. Player info is pushed by the
+        # server when it changes.
         self.update_controls()
         if game.connected:
             self.Pump()
@@ -126,6 +224,13 @@ class DogfightGame(FloatLayout, ConnectionListener):
             obj = objects[i]
             obj.update(delta_time)
         
+        # Remove the weapons that reached the end of their flight.
+        flights = self.flights
+        for object_id in flights.keys():
+            flights[object_id] -= delta_time
+            if flights[object_id] <= 0:
+                self.remove_object(object_id)
+        
         if self.player_id:
             x, y = self.objects[self.player_id].true_pos
             self.starfield.scroll(x, y, 0)
@@ -137,6 +242,9 @@ class DogfightGame(FloatLayout, ConnectionListener):
         
         # If the object doesn't exist, create it.
         object_id = data['object_id']
+        if object_id in self.deleted:
+            return
+        
         if object_id not in self.objects:
             self.add_object(data)
             return
@@ -176,6 +284,8 @@ class DogfightGame(FloatLayout, ConnectionListener):
     
     def remove_object(self, object_id):
         "Remove an object from the screen"
+        self.flights.pop(object_id, None)
+        self.records.pop(object_id, None)
         if object_id in self.objects:
             obj = self.objects[object_id]
             self.space.remove_widget(obj)
@@ -320,6 +430,13 @@ class DogfightApp(App, ConnectionListener):
     def Network_connected(self, data):
         print 'Connected to the server!'
         self.connected = True
+        features = ['delta', 'spawn']
+        if PACKED:
+            features.append('packed')
+        self.Send({
+            'action': 'features',
+            'features': features,
+        })
         self.Send({
             'action': 'collide',
             'size': [(0, 0), (40.5, 144), (81, 0)]
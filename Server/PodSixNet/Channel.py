@@ -1,40 +1,101 @@
-import sys, traceback
+import sys, traceback, socket
 
-from async import asynchat
-from rencode import loads, dumps
+from async import asynchat, asyncore, SelectorMap
+from rencode import loads
+from Shared import Handlers, Messages
 
-class Channel(asynchat.async_chat):
-	endchars = '\0---\0'
+class Channel(Messages, asynchat.async_chat):
+	"""
+	A connection on asyncore/asynchat. Events wait in sendqueue until Pump() writes them together, and the pending state goes with them once asynchat has written everything from earlier Pumps.
+	"""
 	def __init__(self, conn=None, addr=(), server=None, map=None):
 		asynchat.async_chat.__init__(self, conn, map)
+		Messages.__init__(self, server)
 		self.addr = addr
-		self._server = server
-		self._ibuffer = ""
+		self._ibuffer = []
 		self.set_terminator(self.endchars)
 		self.sendqueue = []
+		self.queued = False
 	
 	def collect_incoming_data(self, data):
-		self._ibuffer += data
+		self._ibuffer.append(data)
 	
 	def found_terminator(self):
-		data = loads(self._ibuffer)
-		self._ibuffer = ""
+		data = loads("".join(self._ibuffer))
+		self._ibuffer = []
+		self.Dispatch(data)
 		
-		if type(dict()) == type(data) and data.has_key('action'):
-			[getattr(self, n)(data) for n in ('Network', 'Network_' + data['action']) if hasattr(self, n)]
-		else:
-			print "OOB data (no such Network_action):", data
+		if self.framedRecv:
+			# the rest of what asynchat has read is already length prefixed
+			rest = self.ac_in_buffer
+			self.ac_in_buffer = ""
+			self.set_terminator(None)
+			self._rbuffer[:len(rest)] = rest
+			self._rend = len(rest)
+			self.ReadFrames()
+	
+	def handle_read(self):
+		if not self.framedRecv:
+			return asynchat.async_chat.handle_read(self)
+		
+		if self._rend == len(self._rbuffer):
+			self._rbuffer.extend(bytearray(len(self._rbuffer)))
+		try:
+			received = self.socket.recv_into(memoryview(self._rbuffer)[self._rend:])
+		except socket.error, why:
+			if why.args[0] in asyncore._DISCONNECTED:
+				self.handle_close()
+			else:
+				self.handle_error()
+			return
+		
+		if not received:
+			self.handle_close()
+			return
+		self._rend += received
+		self.ReadFrames()
 	
 	def Pump(self):
-		[asynchat.async_chat.push(self, d) for d in self.sendqueue]
+		"""Writes everything queued since the last Pump() with one push, so it leaves in as few send() calls and packets as possible."""
+		outgoing = self.sendqueue
 		self.sendqueue = []
+		if self.sendstate is not None and not self.producer_fifo:
+			outgoing.append(self.sendstate)
+			self.sendstate = None
+		if outgoing:
+			asynchat.async_chat.push(self, "".join(outgoing))
 	
-	def Send(self, data):
-		"""Returns the number of bytes sent after enoding."""
-		outgoing = dumps(data) + self.endchars
+	def SendEncoded(self, outgoing):
+		"""Queues data which is already encoded and terminated, such as a broadcast from Server.SendToAll. Returns the number of bytes queued."""
+		# state from before this event is out of date
+		self.sendstate = None
 		self.sendqueue.append(outgoing)
+		self.Queued()
 		return len(outgoing)
 	
+	def QueueState(self, outgoing):
+		self.sendstate = outgoing
+		self.Queued()
+	
+	def Queued(self):
+		# a server only pumps the channels which have something to send
+		if not self.queued and self._server is not None:
+			self.queued = True
+			self._server.pending.append(self)
+	
+	def initiate_send(self):
+		asynchat.async_chat.initiate_send(self)
+		if self.producer_fifo and isinstance(self._map, SelectorMap):
+			# the rest is written when the socket becomes writable
+			self._map.Changed(self)
+	
+	def Backlog(self):
+		"""Returns the number of bytes queued but not yet written to the socket, not counting the pending state."""
+		queued = sum([len(d) for d in self.sendqueue])
+		# older asynchat keeps its fifo in a list attribute
+		fifo = getattr(self.producer_fifo, 'list', self.producer_fifo)
+		return queued + sum([len(d) for d in fifo if isinstance(d, str)])
+	
 	def handle_connect(self):
 		if hasattr(self, "Connected"):
 			self.Connected()
@@ -55,6 +116,7 @@ class Channel(asynchat.async_chat):
 		pass
 	
 	def handle_close(self):
+		self.ForgetDatagrams()
 		if hasattr(self, "Close"):
 			self.Close()
 		asynchat.async_chat.handle_close(self)
@@ -8,6 +8,7 @@ This module contains two components: a singleton called 'connection' and a class
 Subclass ConnectionListener in order to have an object that will receive network events. For example, you might have a GUI element which is a label saying how many players there are online. You would declare it like 'class NumPlayersLabel(ConnectionListener, ...):' Later you'd instantitate it 'n = NumPlayersLabel()' and then somewhere in your loop you'd have 'n.Pump()' which asks the connection singleton if there are any new messages from the network, and calls the 'Network_' callbacks for each bit of new data from the server. So you'd implement a method like "def Network_players(self, data):" which would be called whenever a message from the server arrived which looked like {"action": "players", "number": 5}.
 """
 
+from Shared import Handlers
 from EndPoint import EndPoint
 
 connection = EndPoint()
@@ -24,9 +25,26 @@ class ConnectionListener:
 		# check for connection errors:
 		self.Pump()
 	
+	# built by the first Pump()
+	networkHandlers = None
+	networkCatchAll = None
+	unknownActions = None
+	
 	def Pump(self):
+		"""Calls the Network_ method of the action of each message, and then Network(). Actions which neither handles are counted in unknownActions."""
+		if self.networkHandlers is None:
+			self.networkHandlers, self.networkCatchAll = Handlers(self)
+			self.unknownActions = {}
+		handlers = self.networkHandlers
+		catchAll = self.networkCatchAll
 		for data in connection.GetQueue():
-			[getattr(self, n)(data) for n in ("Network_" + data['action'], "Network") if hasattr(self, n)]
+			handler = handlers.get(data['action'])
+			if handler is not None:
+				handler(data)
+			elif catchAll is None:
+				self.unknownActions[data['action']] = self.unknownActions.get(data['action'], 0) + 1
+			if catchAll is not None:
+				catchAll(data)
 	
 	def Send(self, data):
 		""" Convenience method to allow this listener to appear to send network data, whilst actually using connection. """
@@ -0,0 +1,137 @@
+"""
+Optional UDP path for state messages, next to the TCP connection.
+
+Every datagram starts with the token the server gave the connection and a sequence number, followed by the rencoded message. The receiving end drops datagrams older than the newest one it has seen, so late state never replaces newer state. Events keep going over TCP.
+"""
+import socket
+
+from async import asyncore
+# the header and the impairment are shared with Protocol.py, and still importable from here
+from Shared import Header, Impairment, ReadHeader
+
+class DatagramSocket(asyncore.dispatcher):
+	"""
+	A UDP socket polled with the TCP channels, which hands every datagram to receiver(data, addr).
+	"""
+	def __init__(self, address, receiver, map=None):
+		asyncore.dispatcher.__init__(self, map=map)
+		self.create_socket(socket.AF_INET, socket.SOCK_DGRAM)
+		self.bind(address)
+		self.receiver = receiver
+		self.impairment = None
+
+	def writable(self):
+		# datagrams are sent straight away, never buffered
+		return False
+
+	def handle_read(self):
+		try:
+			data, addr = self.socket.recvfrom(65536)
+		except socket.error:
+			return
+		self.receiver(data, addr)
+
+	def handle_connect(self):
+		pass
+
+	def handle_expt(self):
+		pass
+
+	def SendTo(self, data, addr):
+		if self.impairment:
+			self.impairment.Send(self.RawSendTo, data, addr)
+		else:
+			self.RawSendTo(data, addr)
+
+	def RawSendTo(self, data, addr):
+		try:
+			self.socket.sendto(data, addr)
+		except socket.error:
+			# a full socket buffer is just another lost datagram
+			pass
+
+	def Pump(self):
+		if self.impairment:
+			self.impairment.Pump(self.RawSendTo)
+
+#########################
+#	Test stub	#
+#########################
+
+if __name__ == "__main__":
+	import unittest
+	from time import sleep, time
+	
+	from Channel import Channel
+	from EndPoint import EndPoint
+	from Server import Server
+	
+	class DatagramTestCase(unittest.TestCase):
+		def setUp(self):
+			class TestServer(Server):
+				offerDatagrams = True
+				channel = None
+				
+				def Connected(self, channel, addr):
+					self.channel = channel
+			
+			class TestEndPoint(EndPoint):
+				acceptDatagrams = True
+				
+				def __init__(self, address):
+					EndPoint.__init__(self, address)
+					self.states = []
+					self.events = []
+				
+				def Network_state(self, data):
+					self.states.append(data['tick'])
+				
+				def Network_event(self, data):
+					self.events.append(data['tick'])
+			
+			self.server = TestServer(localaddr=("127.0.0.1", 31426))
+			self.endpoint = TestEndPoint(("127.0.0.1", 31426))
+		
+		def Pump(self, seconds):
+			start = time()
+			while time() - start < seconds:
+				self.server.Pump()
+				self.endpoint.Pump()
+				sleep(0.001)
+		
+		def runTest(self):
+			self.endpoint.DoConnect()
+			self.Pump(0.2)
+			channel = self.server.channel
+			self.assertTrue(channel.datagramAddr, "UDP was not set up")
+			self.assertTrue(self.endpoint.datagramAddr, "Endpoint did not hear UDP is ready")
+			
+			# lose a third of the datagrams and reorder the rest
+			self.server.datagrams.impairment = Impairment(loss=0.3, delay=0.01, jitter=0.02, seed=1)
+			for tick in range(1, 101):
+				channel.SendState({"action": "state", "tick": tick})
+				if tick % 10 == 0:
+					channel.Send({"action": "event", "tick": tick})
+				self.Pump(0.002)
+			self.Pump(0.2)
+			
+			states = self.endpoint.states
+			print "states received:", len(states), "of 100"
+			self.assertTrue(0 < len(states) < 100, "Expected some states to be lost")
+			self.assertEqual(states, sorted(set(states)), "A stale state was dispatched")
+			self.assertEqual(self.endpoint.events, range(10, 101, 10), "Events must all arrive in order")
+			
+			# too big for a datagram, so it goes over TCP
+			self.server.datagrams.impairment = None
+			channel.SendState({"action": "state", "tick": 101, "data": "x" * 8192})
+			self.Pump(0.2)
+			self.assertEqual(states[-1], 101)
+		
+		def tearDown(self):
+			self.endpoint.Close()
+			self.server.datagrams.close()
+			self.server.close()
+			del self.server
+			del self.endpoint
+	
+	unittest.main()
@@ -186,6 +186,10 @@ CHR_FALSE = chr(68)
 CHR_NONE = chr(69)
 CHR_TERM = chr(127)
 
+# Strings which are not base64 encoded, with a 1 or 4 byte length.
+CHR_RAW1 = chr(45)
+CHR_RAW4 = chr(46)
+
 # Positive integers with value embedded in typecode.
 INT_POS_FIXED_START = 0
 INT_POS_FIXED_COUNT = 32
@@ -264,6 +268,16 @@ def decode_string(x, f):
     colon += 1
     return (b64decode(x[colon:colon+n]), colon+n)
 
+def decode_raw1(x, f):
+    n = ord(x[f+1])
+    f += 2
+    return (x[f:f+n], f+n)
+
+def decode_raw4(x, f):
+    n = struct.unpack('!L', x[f+1:f+5])[0]
+    f += 5
+    return (x[f:f+n], f+n)
+
 def decode_list(x, f):
     r, f = [], f+1
     while x[f] != CHR_TERM:
@@ -328,6 +342,8 @@ decode_func[CHR_TRUE ] = decode_true
 decode_func[CHR_FALSE] = decode_false
 decode_func[CHR_NONE ] = decode_none
 decode_func[CHR_INSTANCE] = decode_instance
+decode_func[CHR_RAW1] = decode_raw1
+decode_func[CHR_RAW4] = decode_raw4
 
 def make_fixed_length_string_decoders():
     def make_decoder(slen):
@@ -394,6 +410,8 @@ def make_fixed_length_dict_decoders():
 make_fixed_length_dict_decoders()
 
 def loads(x):
+    if isinstance(x, memoryview):
+        x = x.tobytes()
     try:
         r, l = decode_func[x[0]](x, 0)
     except (IndexError, KeyError):
@@ -436,6 +454,14 @@ def encode_none(x, r):
     r.extend(CHR_NONE)
 
 def encode_string(x, r):
+    if not b64_strings:
+        if isinstance(x, UnicodeType):
+            x = x.encode('utf-8')
+        if len(x) < 256:
+            r.extend((CHR_RAW1, chr(len(x)), x))
+        else:
+            r.extend((CHR_RAW4, struct.pack('!L', len(x)), x))
+        return
     x = b64encode(x)
     if len(x) < STR_FIXED_COUNT:
         r.extend((chr(STR_FIXED_START + len(x)), x))
@@ -509,11 +535,23 @@ def encode_instance(x, r):
 
 lock = Lock()
 
-def dumps(x):
+# Set by dumps() while it holds the lock.
+b64_strings = True
+
+def dumps(x, b64=True):
+    """
+    Encode x. With b64=False strings are sent as they are, which is only
+    safe when the messages are not separated by a terminator.
+    """
+    global b64_strings
     lock.acquire()
-    r = []
-    encode_func.get(type(x), encode_instance)(x, r)
-    lock.release()
+    try:
+        b64_strings = b64
+        r = []
+        encode_func.get(type(x), encode_instance)(x, r)
+    finally:
+        b64_strings = True
+        lock.release()
     return ''.join(r)
 
 def test():
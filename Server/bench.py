@@ -0,0 +1,363 @@
+"""
+Microbenchmarks for the server simulation.
+
+To run them:
+    python bench.py
+
+and to compare the asyncore and asyncio PodSixNet servers over loopback:
+    python bench.py transport
+
+and to see where the collision tests spend their time:
+    python bench.py collision
+"""
+import sys
+from math import cos, sin, radians
+from multiprocessing import Event, Process
+from time import sleep, time
+
+import entity
+import trig
+from broadphase import SpatialHash
+from collision import collision_stats
+from codec import pack_updates, unpack_updates
+from PodSixNet.rencode import dumps, loads
+from player import Player
+from weapon import Weapon
+
+FRAME_TIME = 1.0 / 30
+
+
+def legacy_heading(angle):
+    return sin(radians(angle)), cos(radians(angle))
+
+
+def legacy_caps(angle, accel, max_speed):
+    "The velocity caps as Entity.update used to find them."
+    temp_vx = 0
+    temp_vy = 0
+    while abs(temp_vx) + abs(temp_vy) < max_speed:
+        temp_vx += sin(radians(angle)) * accel
+        temp_vy += cos(radians(angle)) * accel
+    return temp_vx, temp_vy
+
+
+def new_functions():
+    ids = [0]
+    def new_id():
+        ids[0] += 1
+        return ids[0]
+    
+    return {
+        'new_id': new_id,
+        'add_entity': lambda entity, etype='': None,
+        'remove_entity': lambda entity: None,
+        'system_size': 1000,
+    }
+
+
+def timed(run, count):
+    "Return the time per call of run in microseconds."
+    start = time()
+    run(count)
+    return (time() - start) / count * 1000000
+
+
+def bench_turning(count):
+    "A player that thrusts and turns every update."
+    player = Player(new_functions())
+    player.controls['thrust'] = 1
+    player.controls['turning'] = 2
+    def run(count):
+        update = player.update
+        for i in xrange(count):
+            update(FRAME_TIME)
+    return timed(run, count)
+
+
+def bench_weapon(count):
+    "The first update of a freshly fired weapon."
+    functions = new_functions()
+    weapons = []
+    for i in xrange(count):
+        weapon = Weapon(functions)
+        weapon.angle = (i * 7.3) % 360
+        weapon.accel = 100
+        weapon.max_speed = 300 + 150
+        weapon.controls['thrust'] = 1
+        weapons.append(weapon)
+    
+    def run(count):
+        for weapon in weapons:
+            weapon.update(FRAME_TIME)
+    return timed(run, count)
+
+
+def bench_caps(caps, count):
+    "The cap computation alone, for a weapon heading."
+    accel = 100 * FRAME_TIME
+    def run(count):
+        for i in xrange(count):
+            caps(i % 360 + 0.5, accel, 450)
+    return timed(run, count)
+
+
+def best(bench, *args):
+    "Return the best of a few runs of a benchmark."
+    return min(bench(*args) for i in xrange(3))
+
+
+def sample_updates(count):
+    "Update dicts like a busy tick sends."
+    updates = []
+    for i in xrange(count):
+        updates.append({
+            'object_id': 1000 + i,
+            'type': 'bullet' if i % 8 else 'player',
+            'pos_x': (i * 37.1) % 2000 - 1000,
+            'pos_y': (i * 91.7) % 2000 - 1000,
+            'angle': (i * 7.3) % 360,
+            'vel_x': (i * 3.3) % 600 - 300,
+            'vel_y': (i * 5.9) % 600 - 300,
+            'vel_angle': (i % 3 - 1) * 180,
+        })
+    return updates
+
+
+def bench_codec(encode, decode, count):
+    "Bytes, encode and decode microseconds per entity for one update."
+    updates = sample_updates(count)
+    data = encode(updates)
+    encode_time = best(timed, lambda n: [encode(updates) for i in xrange(n)], 20)
+    decode_time = best(timed, lambda n: [decode(data) for i in xrange(n)], 20)
+    return (float(len(data)) / count, encode_time / count,
+            decode_time / count)
+
+
+def legacy_collision(target, other, offset):
+    "The collision test as Entity.test_collision used to run it."
+    polygon = other.placed_polygon(offset)
+    distance = target.polygon.distance(polygon)
+    distance = abs(distance[0]) + abs(distance[1])
+    if distance < target.collide_size:
+        return target.polygon.collidepoly(polygon).any()
+    return False
+
+
+def collision_pairs(ships, bullets, Bullet):
+    """
+    The broadphase candidates of bullets flying among ships, as
+    (ship, bullet, offset). Bullet is Weapon for bullets that collide as
+    segments, or Entity for the boxes they used to be.
+    """
+    functions = new_functions()
+    grid = SpatialHash(functions['system_size'], entity.COLLIDE_SIZE)
+    functions['move_entity'] = grid.move
+    
+    def scatter(e, i):
+        e.move((i * 137.3) % 400 - 200, (i * 71.9) % 400 - 200)
+        e.rotate((i * 53.1) % 360)
+    
+    for i in xrange(ships):
+        ship = Player(functions)
+        grid.add(ship)
+        scatter(ship, i)
+    
+    pairs = []
+    for i in xrange(bullets):
+        bullet = Bullet(functions)
+        scatter(bullet, i * 7 + 3)
+        if isinstance(bullet, Weapon):
+            # Fly for a step, so it sweeps a segment.
+            bullet.max_speed = 450
+            bullet.launch(FRAME_TIME)
+            bullet.update(FRAME_TIME)
+        for ship, offset in grid.query(bullet):
+            pairs.append((ship, bullet, offset))
+    return pairs
+
+
+def bench_collision(test, pairs):
+    "Microseconds per candidate pair."
+    def run(count):
+        for i in xrange(count):
+            for target, other, offset in pairs:
+                test(target, other, offset)
+    return timed(run, 10) / len(pairs)
+
+
+def run_clients(port, count, stop):
+    """
+    Connect count clients which answer every message with an ack, until
+    stop is set. Runs in its own process, on plain sockets so the clients
+    cost the same for every server.
+    """
+    import select
+    import socket
+    from PodSixNet.Channel import Channel
+    
+    endchars = Channel.endchars
+    ack = dumps({'action': 'ack'}) + endchars
+    
+    sockets = {}
+    rest = {}
+    poller = select.poll()
+    for i in xrange(count):
+        sock = socket.create_connection(('127.0.0.1', port))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sockets[sock.fileno()] = sock
+        rest[sock.fileno()] = ''
+        poller.register(sock, select.POLLIN)
+    
+    while not stop.is_set():
+        for fd, event in poller.poll(100):
+            sock = sockets[fd]
+            messages = (rest[fd] + sock.recv(65536)).split(endchars)
+            rest[fd] = messages.pop()
+            if messages:
+                sock.sendall(ack * len(messages))
+
+
+def bench_transport(Channel, Server, count, seconds):
+    """
+    Broadcast a message to count clients and wait for all their acks, over
+    and over. Return the rounds per second.
+    """
+    class AckChannel(Channel):
+        def Network_ack(self, data):
+            self._server.acks += 1
+    
+    class AckServer(Server):
+        acks = 0
+    
+    server = AckServer(channelClass=AckChannel, localaddr=('127.0.0.1', 0),
+                       listeners=count)
+    if hasattr(server, 'address'):
+        port = server.address[1]
+    else:
+        port = server.socket.getsockname()[1]
+    
+    stop = Event()
+    clients = Process(target=run_clients, args=(port, count, stop))
+    clients.start()
+    while len(server.channels) < count:
+        server.Pump()
+    
+    message = {'action': 'round', 'updates': sample_updates(4)}
+    rounds = 0
+    start = time()
+    while time() - start < seconds:
+        server.acks = 0
+        server.SendToAll(message)
+        while server.acks < count:
+            acks = server.acks
+            server.Pump()
+            if server.acks == acks:
+                # let the clients run, there may be only one core
+                sleep(0.0001)
+        rounds += 1
+    elapsed = time() - start
+    
+    stop.set()
+    clients.join()
+    for channel in list(server.channels):
+        channel.close()
+    server.close()
+    return rounds / elapsed
+
+
+def main_transport():
+    import PodSixNet.Channel
+    import PodSixNet.Protocol
+    import PodSixNet.Server
+    
+    transports = (
+        ('asyncore', PodSixNet.Channel.Channel, PodSixNet.Server.Server),
+        ('asyncio', PodSixNet.Protocol.Channel, PodSixNet.Protocol.Server),
+    )
+    print '%-12s %14s %14s %14s' % ('rounds/s', '10 clients', '100 clients',
+                                     '1000 clients')
+    for label, Channel, Server in transports:
+        results = [bench_transport(Channel, Server, count, 5)
+                   for count in (10, 100, 1000)]
+        print '%-12s %14.1f %14.1f %14.1f' % ((label,) + tuple(results))
+
+
+def main_collision():
+    boxes = collision_pairs(50, 500, entity.Entity)
+    Weapon.swept = True
+    segments = collision_pairs(50, 500, Weapon)
+    staged = lambda target, other, offset: target.test_collision(other, offset)
+    legacy = best(bench_collision, legacy_collision, boxes)
+    collision_stats.reset()
+    results = (
+        ('box bullets', len(boxes), 'distance + collidepoly', legacy),
+        ('', len(boxes), 'bounds + collidepoly',
+         bench_collision(staged, boxes)),
+        ('segment bullets', len(segments), 'bounds + collidesegments',
+         bench_collision(staged, segments)),
+    )
+    
+    # The same bullets with continuous collision detection.
+    Weapon.ccd = True
+    results += (('', len(segments), 'bounds + raycast',
+                 bench_collision(staged, segments)),)
+    Weapon.ccd = False
+    Weapon.swept = False
+    
+    for label, count, test, pair_time in results:
+        print '%-16s %5d pairs %-26s %8.1f us/pair' % (label, count, test,
+                                                       pair_time)
+    print collision_stats.report()
+
+
+def main():
+    if sys.argv[1:] == ['transport']:
+        main_transport()
+        return
+    
+    if sys.argv[1:] == ['collision']:
+        main_collision()
+        return
+    
+    main_update()
+    print
+    main_codec()
+
+
+def main_codec():
+    count = 500
+    codecs = (
+        ('rencode', lambda u: dumps(u), loads),
+        ('rencode (framed)', lambda u: dumps(u, b64=False), loads),
+        ('packed', pack_updates, unpack_updates),
+    )
+    print '%-18s %12s %14s %14s' % ('', 'bytes/entity', 'encode/entity',
+                                   'decode/entity')
+    for label, encode, decode in codecs:
+        size, encode_time, decode_time = bench_codec(encode, decode, count)
+        print '%-18s %12.1f %11.2f us %11.2f us' % (label, size, encode_time,
+                                                    decode_time)
+
+
+def main_update():
+    count = 2000
+    results = []
+    for label, heading, caps in (
+            ('before', legacy_heading, legacy_caps),
+            ('after', trig.heading, trig.velocity_caps)):
+        entity.heading = heading
+        entity.velocity_caps = caps
+        results.append((label, best(bench_turning, count),
+                        best(bench_weapon, count),
+                        best(bench_caps, caps, count)))
+    
+    entity.heading = trig.heading
+    entity.velocity_caps = trig.velocity_caps
+    
+    print '%-8s %16s %16s %16s' % ('', 'turning ship', 'new weapon', 'caps only')
+    for label, turning, weapon, caps in results:
+        print '%-8s %13.1f us %13.1f us %13.1f us' % (label, turning, weapon, caps)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+from itertools import product
+
+from numpy import zeros
+
+
+def nearby(positions, x, y, radius, system_size):
+    """
+    Return a mask of the positions (an N x 2 array) within radius of x, y,
+    measured the short way around the wrapped system.
+    """
+    system_wrap = system_size * 2
+    offsets = (positions - (x, y) + system_size) % system_wrap - system_size
+    return (offsets * offsets).sum(1) <= radius * radius
+
+
+def near_segments(starts, ends, x, y, radius, system_size):
+    """
+    Return a mask of the segments (from the N x 2 starts to the ends) that
+    pass within radius of x, y, measured the short way around the wrapped
+    system. Segments must be shorter than the system is wide.
+    """
+    system_wrap = system_size * 2
+    flight = ends - starts
+    length = (flight * flight).sum(1)
+    length[length == 0] = 1
+    offsets = ((x, y) - starts + system_size) % system_wrap - system_size
+
+    # The point is measured from the start of each segment, so the copy
+    # across the seam closest to the segment is at most one wrap away.
+    mask = zeros(len(starts), bool)
+    for shift in product((-system_wrap, 0, system_wrap), repeat=2):
+        shifted = offsets + shift
+        along = ((shifted * flight).sum(1) / length).clip(0, 1)
+        away = shifted - flight * along[:, None]
+        mask |= (away * away).sum(1) <= radius * radius
+    return mask
+
+
+class SpatialHash(object):
+    "Uniform grid over the wrapped system, used to find collision candidates."
+
+    def __init__(self, system_size, collide_size):
+        self.system_size = system_size
+        self.system_wrap = system_size * 2
+
+        # Cells are a few collision boxes wide so most entities only touch
+        # one to four of them. Use a whole number of cells so the grid wraps
+        # exactly where the system does.
+        self.count = max(1, int(self.system_wrap // (collide_size * 4)))
+        self.cell_size = float(self.system_wrap) / self.count
+
+        self.cells = {}
+        self.members = {}
+        self.places = {}
+
+    def cell_keys(self, x, y, radius):
+        "Return the cells covered by a bounding box, wrapped around the system."
+        size = self.cell_size
+        count = self.count
+        offset = self.system_size
+
+        x0 = int((x - radius + offset) // size)
+        x1 = int((x + radius + offset) // size)
+        y0 = int((y - radius + offset) // size)
+        y1 = int((y + radius + offset) // size)
+
+        # Boxes larger than the system cover every row or column once.
+        if x1 - x0 >= count:
+            x0, x1 = 0, count - 1
+        if y1 - y0 >= count:
+            y0, y1 = 0, count - 1
+
+        return tuple((i % count, j % count)
+                     for i in xrange(x0, x1 + 1)
+                     for j in xrange(y0, y1 + 1))
+
+    def entity_keys(self, entity, x=None, y=None):
+        "Return the cells an entity covers, at x, y when they are given."
+        if x is None:
+            x, y = entity.pos_x, entity.pos_y
+        return self.cell_keys(x, y, entity.shape.radius)
+
+    def add(self, entity, x=None, y=None):
+        """
+        Start tracking an entity. Its position is remembered until it moves,
+        so queries never read it back from the entity.
+        """
+        if x is None:
+            x, y = entity.pos_x, entity.pos_y
+        keys = self.entity_keys(entity, x, y)
+        self.members[entity] = keys
+        self.places[entity] = (x, y)
+        cells = self.cells
+        for key in keys:
+            if key in cells:
+                cells[key].append(entity)
+            else:
+                cells[key] = [entity]
+
+    def remove(self, entity):
+        "Stop tracking an entity."
+        keys = self.members.pop(entity, ())
+        self.places.pop(entity, None)
+        cells = self.cells
+        for key in keys:
+            cell = cells[key]
+            cell.remove(entity)
+            if not cell:
+                del cells[key]
+
+    def move(self, entity, x=None, y=None):
+        "Update the cells of an entity after it moved, to x, y if given."
+        if entity not in self.members:
+            return
+
+        if x is None:
+            x, y = entity.pos_x, entity.pos_y
+        self.places[entity] = (x, y)
+        if self.entity_keys(entity, x, y) != self.members[entity]:
+            self.remove(entity)
+            self.add(entity, x, y)
+
+    def wrap_offset(self, dx, dy):
+        """
+        Return the offset that moves a point dx, dy away from an entity next
+        to it across the system seam, (0, 0) when it is on the same side.
+        """
+        system_wrap = self.system_wrap
+        return (round(float(dx) / system_wrap) * system_wrap,
+                round(float(dy) / system_wrap) * system_wrap)
+
+    def query(self, other, x=None, y=None, margin=0):
+        """
+        Yield (entity, offset) for every tracked entity near other, which is
+        at x, y when they are given. The area searched grows by margin
+        pixels.
+        """
+        if x is None:
+            x, y = other.pos_x, other.pos_y
+        cells = self.cells
+        places = self.places
+        seen = set()
+        for key in self.cell_keys(x, y, other.shape.radius + margin):
+            if key not in cells:
+                continue
+
+            for entity in cells[key]:
+                if entity in seen or entity is other:
+                    continue
+
+                seen.add(entity)
+                ex, ey = places[entity]
+                yield entity, self.wrap_offset(ex - x, ey - y)
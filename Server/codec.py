@@ -0,0 +1,65 @@
+"""
+Fixed layout binary records for entity updates. Each record holds the id,
+a type code and the movement fields as fixed point numbers. The same file
+is used by the server and the client.
+"""
+try:
+    from numpy import array, clip, dtype, frombuffer, rint, zeros
+    PACKED = True
+except ImportError:
+    # Without NumPy clients keep using the rencode updates.
+    PACKED = False
+
+TYPES = ('entity', 'player', 'bullet', 'planet')
+TYPE_CODES = dict((name, code) for code, name in enumerate(TYPES))
+
+# Fixed point fields and how many steps there are per unit.
+FIELDS = ('pos_x', 'pos_y', 'vel_x', 'vel_y', 'angle', 'vel_angle')
+SCALES = (16.0, 16.0, 16.0, 16.0, 65536 / 360.0, 16.0)
+
+if PACKED:
+    RECORD = dtype([
+        ('object_id', '>u4'),
+        ('type', 'u1'),
+        ('pos_x', '>i2'),
+        ('pos_y', '>i2'),
+        ('vel_x', '>i2'),
+        ('vel_y', '>i2'),
+        ('angle', '>u2'),
+        ('vel_angle', '>i2'),
+    ])
+
+
+def pack_updates(updates):
+    "Pack a list of update dicts into one string of records."
+    records = zeros(len(updates), RECORD)
+    if not updates:
+        return records.tostring()
+    
+    records['object_id'] = [u['object_id'] for u in updates]
+    records['type'] = [TYPE_CODES.get(u['type'], 0) for u in updates]
+    
+    values = array([[u[field] for field in FIELDS] for u in updates], float)
+    values = rint(values * SCALES)
+    for i, field in enumerate(FIELDS):
+        if field == 'angle':
+            records[field] = values[:, i] % 65536
+        else:
+            records[field] = clip(values[:, i], -32768, 32767)
+    return records.tostring()
+
+
+def unpack_updates(data):
+    "Return the records as update dicts."
+    records = frombuffer(data, RECORD)
+    ids = records['object_id'].astype(int).tolist()
+    types = [TYPES[code] for code in records['type'].tolist()]
+    rows = zip(*[(records[field] / scale).tolist()
+                 for field, scale in zip(FIELDS, SCALES)])
+    updates = []
+    for object_id, kind, values in zip(ids, types, rows):
+        update = dict(zip(FIELDS, values))
+        update['object_id'] = object_id
+        update['type'] = kind
+        updates.append(update)
+    return updates
@@ -0,0 +1,60 @@
+class CollisionStats(object):
+    """
+    Pairs entered and rejected by each stage of the collision tests, to see
+    where the collision time goes. A stage only gets the pairs the stages
+    before it let through. Projectiles that collide as a segment go from the
+    bounds straight to the segment test, or to the cast with continuous
+    collision detection.
+    """
+    
+    STAGES = ('bounds', 'cached', 'exact', 'segment', 'cast')
+    
+    def __init__(self):
+        self.reset()
+    
+    def reset(self):
+        "Start counting from zero."
+        self.entered = dict.fromkeys(self.STAGES, 0)
+        self.rejected = dict.fromkeys(self.STAGES, 0)
+    
+    def count(self, stage, entered, rejected):
+        "Add the pairs that entered a stage and the ones it rejected."
+        self.entered[stage] += entered
+        self.rejected[stage] += rejected
+    
+    def report(self):
+        "Return one line with the pairs entered and rejected by each stage."
+        return ', '.join('%s: %d in, %d rejected' % (stage, self.entered[stage],
+                                                     self.rejected[stage])
+                         for stage in self.STAGES)
+
+
+class AxisCache(object):
+    """
+    The axis that last separated each pair of entities which are still
+    collision candidates. Ships and bullets only move a few pixels per step,
+    so the same axis usually separates them again and is tried before the
+    full test. Pairs that were not kept during a step are forgotten at the
+    end of it, once they leave the broadphase or collide.
+    """
+    
+    def __init__(self):
+        self.axes = {}
+        self.kept = {}
+    
+    def get(self, pair):
+        "Return the axis that separated a pair in the last step, or None."
+        return self.axes.get(pair)
+    
+    def keep(self, pair, axis):
+        "Remember an axis that separates a pair for the next step."
+        self.kept[pair] = axis
+    
+    def end_step(self):
+        "Forget the pairs that were not kept during this step."
+        self.axes = self.kept
+        self.kept = {}
+
+
+# Counts of every collision test in the process.
+collision_stats = CollisionStats()
@@ -1,5 +1,11 @@
-from math import cos, sin, radians
-from pylygon.polygon import Polygon
+from numpy import array
+from pylygon import Polygon, collidesegments
+
+from collision import collision_stats
+from shape import Shape
+from trig import heading, velocity_caps
+
+COLLIDE_SIZE = 10 # In pixels
 
 class Entity(object):
     
@@ -27,9 +33,8 @@ class Entity(object):
         self.health = 10
         
         
-        collide_size = 10 # In pixels
-        self.collide_size = 10
-        self.new_collide_size(collide_size)
+        self.collide_size = COLLIDE_SIZE
+        self.new_collide_size(COLLIDE_SIZE)
         
         self.type = 'entity'
         
@@ -47,31 +52,112 @@ class Entity(object):
         "Set new collision box size."
         self.collide_size = collide_size
         new_box = []
-        new_box.append((self.pos_y + collide_size, self.pos_x - collide_size))
-        new_box.append((self.pos_y + collide_size, self.pos_x + collide_size))
-        new_box.append((self.pos_y - collide_size, self.pos_x + collide_size))
-        new_box.append((self.pos_y - collide_size, self.pos_x - collide_size))
+        new_box.append((-collide_size, collide_size))
+        new_box.append((collide_size, collide_size))
+        new_box.append((collide_size, -collide_size))
+        new_box.append((-collide_size, -collide_size))
         self.new_polygon(new_box)
     
     def new_polygon(self, poly):
         "New collision zone for the object."
-        self.polygon = Polygon(poly)
+        self.shape = Shape(poly)
+        self.placed = None
+        self.placed_at = None
         self.move(self.pos_x, self.pos_y)
     
+    @property
+    def polygon(self):
+        "The collision zone in world space, only built when it is needed."
+        transform = (self.pos_x, self.pos_y, self.angle)
+        if transform != self.placed_at:
+            self.placed = self.shape.place(*transform)
+            self.placed_at = transform
+        return self.placed
+    
+    def placed_polygon(self, offset=(0, 0)):
+        "The collision zone in world space, moved by offset."
+        if offset == (0, 0):
+            return self.polygon
+        
+        x, y = offset
+        return self.shape.place(self.pos_x + x, self.pos_y + y, self.angle)
+    
     def hit_by(self, other):
         "What to do when hit by another object"
         pass
     
-    def test_collision(self, other):
-        "Check if a collision with another polygon exists"
-        distance = self.polygon.distance(other)
-        distance = abs(distance[0]) + abs(distance[1])
-        if (distance) < (self.collide_size):
-            collision = self.polygon.collidepoly(other)
-            if collision.any():
-                return True
+    def ignores(self, other):
+        "Check if collisions with another entity are skipped."
         return False
     
+    def segment(self, offset=(0, 0)):
+        """
+        Return the segment a point collider swept in the last step, or None
+        when the entity collides with its polygon.
+        """
+        return None
+    
+    def bounds_overlap(self, other, offset=(0, 0), margin=0):
+        """
+        Check if the bounding circles of two entities overlap, grown by
+        margin pixels.
+        """
+        dx = other.pos_x + offset[0] - self.pos_x
+        dy = other.pos_y + offset[1] - self.pos_y
+        reach = self.shape.radius + other.shape.radius + margin
+        return dx * dx + dy * dy <= reach * reach
+    
+    def cast(self, segment, duration):
+        """
+        Return when a point flying along segment in the last step, which
+        took duration seconds, hit the entity as a fraction of the step, or
+        None if it missed. The movement of the entity in that step is cast
+        against as well, but not its turning.
+        """
+        (x0, y0), (x1, y1) = segment
+        dx = self.vel_x * duration
+        dy = self.vel_y * duration
+        start = self.shape.place(self.pos_x - dx, self.pos_y - dy, self.angle)
+        
+        # Cast the point against the entity where it started the step.
+        motion = array((x1 - x0 - dx, y1 - y0 - dy))
+        result = Polygon([(x0, y0)]).raycast(start, -motion)
+        if result is False:
+            return None
+        return result[0]
+    
+    def test_collision(self, other, offset=(0, 0)):
+        """
+        Check if a collision with another entity exists. The offset moves
+        the other entity across the system seam when it is on the far side.
+        Only pairs whose bounding circles overlap get the exact test. With
+        continuous collision detection, the circles grow by how far this
+        entity moved in the step, as the cast does.
+        """
+        margin = 0
+        if getattr(other, 'ccd', False):
+            margin = self.speed * other.sweep_time
+        overlap = self.bounds_overlap(other, offset, margin)
+        collision_stats.count('bounds', 1, not overlap)
+        if not overlap:
+            return False
+        
+        segment = other.segment(offset)
+        if segment is not None and other.ccd:
+            hit = self.cast(segment, other.sweep_time) is not None
+            collision_stats.count('cast', 1, not hit)
+            return hit
+        
+        if segment is not None:
+            hit = bool(collidesegments([self.polygon], [segment])[0][0])
+            collision_stats.count('segment', 1, not hit)
+            return hit
+        
+        polygon = other.placed_polygon(offset)
+        hit = bool(self.polygon.collidepoly(polygon).any())
+        collision_stats.count('exact', 1, not hit)
+        return hit
+    
     def move(self, x, y):
         "Moves the object and it's collision layer"
         
@@ -89,14 +175,16 @@ class Entity(object):
             y += system_wrap
         
         # Set the position
-        self.polygon.C = x, y
         self.pos_x = x
         self.pos_y = y
+        
+        # Keep the collision grid up to date.
+        if 'move_entity' in self.functions:
+            self.functions['move_entity'](self)
     
     def rotate(self, angle):
         "Rotate the entity and the collision box"
         self.angle = angle
-        self.polygon.rotate(radians(angle))
         
     def update(self, delta_time):
         "Update ship position and direction"
@@ -106,14 +194,7 @@ class Entity(object):
         
         if self.old_angle != angle:
             self.old_angle = angle
-            temp_vx = 0
-            temp_vy = 0
-            while abs(temp_vx) + abs(temp_vy) < self.max_speed:
-                temp_vx += sin(radians(angle)) * accel
-                temp_vy += cos(radians(angle)) * accel
-            
-            self.max_x = temp_vx
-            self.max_y = temp_vy
+            self.max_x, self.max_y = velocity_caps(angle, accel, self.max_speed)
         
         max_x = self.max_x
         max_y = self.max_y
@@ -121,8 +202,9 @@ class Entity(object):
         if controls['thrust'] == 1:
             # Calculate what the future velocities will be. If they are greater
             # than the max speeds calculated earlier, ignore it.
-            future_x = self.vel_x + sin(radians(angle)) * accel
-            future_y = self.vel_y + cos(radians(angle)) * accel
+            sin_a, cos_a = heading(angle)
+            future_x = self.vel_x + sin_a * accel
+            future_y = self.vel_y + cos_a * accel
             
             if (future_y < max_y) if max_y > 0 else (future_y > max_y):
                 self.vel_y = future_y
@@ -22,6 +22,9 @@ class Player(Entity):
         self.cooldown = self.weapon_cooldown
         
         self.name = 'Observer'
+        
+        # Set when get_info() changes, so the server pushes it to the client.
+        self.info_changed = True
         self.controls = {
             'thrust': 0,
             'turning': 0,
@@ -37,8 +40,14 @@ class Player(Entity):
         self.vel_y = 0
         self.vel_angle = 0
         self.health = self.max_health
+        self.info_changed = True
         self.move(0, 0)
     
+    def new_polygon(self, poly):
+        "New collision zone, which the client hears about with the info."
+        Entity.new_polygon(self, poly)
+        self.info_changed = True
+    
     def get_info(self):
         "Return information regarding the player."
         data = {
@@ -66,28 +75,29 @@ class Player(Entity):
     def hit_by(self, other):
         "Take damage from object."
         self.health -= other.damage
+        self.info_changed = True
         if self.health <= 0:
             # Reset location to the center of the system.
             self.reset_player()
     
-    def test_collision(self, other):
-        "Check if a collision with another polygon exists."
+    def ignores(self, other):
+        "Check if collisions with another entity are skipped."
+        # Its own weapons, without keeping a list of every one it fired.
+        if getattr(other, 'owner', None) is self:
+            return True
+        return other in self.ignore_list
+    
+    def test_collision(self, other, offset=(0, 0)):
+        "Check if a collision with another entity exists."
         
-        # If in the ignore list, then don't test for collisions.
-        if other in self.ignore_list:
+        # If ignored, then don't test for collisions.
+        if self.ignores(other):
             return False
         
-        # First check distance
-        distance = self.polygon.distance(other)
-        distance = abs(distance[0]) + abs(distance[1])
-        if (distance) < (self.collide_size):
-            # Then do a more detailed test
-            collision = self.polygon.collidepoly(other)
-            if collision.any():
-                return True
-        return False
+        return Entity.test_collision(self, other, offset)
         
-    def update(self, delta_time):
+    def update_weapon(self, delta_time):
+        "Fire a new weapon once the cooldown is over."
         if self.cooldown <= 0 and self.controls['attack']:
             self.cooldown = self.weapon_cooldown
             weapon = Weapon(self.functions)
@@ -98,11 +108,14 @@ class Player(Entity):
             weapon.max_speed = 300 + self.speed
             weapon.max_life = 0.3
             weapon.controls['thrust'] = 1
-            self.ignore_list.append(weapon.polygon)
+            weapon.launch(delta_time)
+            weapon.owner = self
             
             self.functions['add_entity'](weapon, etype='collider')
         
         else:
             self.cooldown -= delta_time
-            
+        
+    def update(self, delta_time):
+        self.update_weapon(delta_time)
         return Entity.update(self, delta_time)
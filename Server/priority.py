@@ -0,0 +1,62 @@
+# How much each type of entity matters to a client, per broadcast.
+TYPE_PRIORITY = {
+    'player': 4.0,
+    'bullet': 2.0,
+    'planet': 0.5,
+}
+DEFAULT_PRIORITY = 1.0
+
+# Distance at which an entity counts half as much as one next to the ship.
+FALLOFF = 300.0
+
+
+class PriorityBudget(object):
+    """
+    Chooses the changed records sent to one client when they do not all fit
+    in its byte budget. Each broadcast a record waits, the priority of its
+    entity grows by its type weight scaled down with the distance to the
+    client's ship, so stale entities far away still get their turn.
+    """
+
+    def __init__(self, viewer, budget, record_size):
+        self.viewer = viewer
+        self.budget = budget
+        self.record_size = record_size
+        self.accumulated = {}
+
+    def weight(self, record):
+        "Priority gained by a record in one broadcast."
+        viewer = self.viewer
+        if record['object_id'] == viewer.object_id:
+            return float('inf')
+
+        # Measure the short way around the wrapped system.
+        system_size = viewer.system_size
+        system_wrap = system_size * 2
+        dx = (record['pos_x'] - viewer.pos_x + system_size) % system_wrap
+        dy = (record['pos_y'] - viewer.pos_y + system_size) % system_wrap
+        distance = abs(dx - system_size) + abs(dy - system_size)
+
+        priority = TYPE_PRIORITY.get(record.get('type'), DEFAULT_PRIORITY)
+        return priority * FALLOFF / (FALLOFF + distance)
+
+    def select(self, records):
+        "Return the ids of the records to send now, out of a dict by id."
+        accumulated = self.accumulated
+        for object_id in [i for i in accumulated if i not in records]:
+            del accumulated[object_id]
+
+        for object_id, record in records.iteritems():
+            accumulated[object_id] = (accumulated.get(object_id, 0) +
+                                      self.weight(record))
+
+        count = int(self.budget // self.record_size)
+        if count >= len(records):
+            chosen = set(records)
+        else:
+            order = sorted(records, key=accumulated.get, reverse=True)
+            chosen = set(order[:count])
+
+        for object_id in chosen:
+            del accumulated[object_id]
+        return chosen
@@ -1,3 +1,4 @@
+from .batch import castpoints, collidepolys, collidesegments, separated
 from .convexhull import convexhull
 from .line import Line
 from .polygon import Polygon
@@ -0,0 +1,189 @@
+"""
+batched collision tests over many pairs of polygons
+"""
+
+from __future__ import division
+
+from numpy import (arange, array, concatenate, einsum, empty, errstate, inf,
+                   where)
+
+# error tolerances
+_MACHEPS = pow(2, -24)
+
+
+
+def _stack(arrays):
+    """
+    stack 2d arrays of (x, y) rows into one N x K x 2 array, where K is the
+    length of the longest.  shorter arrays are padded by repeating their last
+    row; a repeated vertex or axis projects the same as the original, so the
+    padding never changes a result and needs no mask
+    """
+    K = max(len(a) for a in arrays)
+    if all(len(a) == K for a in arrays): return array(arrays, dtype=float)
+    stacked = empty((len(arrays), K, 2))
+    for i, a in enumerate(arrays):
+        n = len(a)
+        stacked[i, :n] = a
+        stacked[i, n:] = a[-1]
+    return stacked
+
+
+def _project(P, axes):
+    # the span of every polygon in P projected onto each of its axes, as the
+    # N x K arrays of minimums and maximums
+    projections = einsum('nvi,nki->nvk', P, axes)
+    return projections.min(1), projections.max(1)
+
+
+def separated(pairs, axes):
+    """
+    test many pairs of polygons against one given axis each, such as the axis
+    that separated the pair the last time it was tested.  this costs one
+    projection per vertex, where collidepolys projects every vertex onto every
+    edge axis of the pair
+
+    arguments:
+    pairs -- a sequence of (a, b) pairs of Polygon objects
+    axes -- a sequence of (x, y) axes, one for each pair
+
+    returns:
+    a boolean array, True for each pair that its axis separates.  a pair that
+      is not separated may still not collide
+    """
+    if not len(pairs): return array([], dtype=bool)
+    A = _stack([a.P for a, b in pairs])
+    B = _stack([b.P for a, b in pairs])
+    axes = array(axes, dtype=float).reshape(-1, 1, 2)
+    a = (A * axes).sum(2)
+    b = (B * axes).sum(2)
+    apart = (a.max(1) <= b.min(1)) | (b.max(1) <= a.min(1))
+    # a zero axis projects everything onto one point, which separates nothing
+    return apart & ((axes * axes).sum(2)[:, 0] > _MACHEPS)
+
+
+def collidepolys(pairs, separating=False):
+    """
+    test many pairs of polygons for collision with the separating axis
+    theorem, in one vectorized pass instead of one Polygon.collidepoly per pair
+
+    the vertices of every pair and the axes of its edges, which every Polygon
+    keeps normalized, are stacked into padded N x K x 2 arrays, every polygon is projected onto all the axes of
+    its pair at once, and a pair collides when the projections overlap on
+    every axis
+
+    arguments:
+    pairs -- a sequence of (a, b) pairs of Polygon objects
+
+    keyword arguments:
+    separating -- boolean indicating if the axes should be returned as well.
+      False by default
+
+    returns:
+    hits -- a boolean array, True for each pair that collides
+    mtv -- an N x 2 array of minimum translation vectors; the shortest move of
+      b that separates it from a, or (0, 0) for the pairs that do not collide
+    axes -- only if separating is True; an N x 2 array of unit axes.  for the
+      pairs that do not collide, the axis that separates them the most, which
+      can be given to separated the next time the pair is tested
+    """
+    N = len(pairs)
+    if not N:
+        if separating: return array([], dtype=bool), empty((0, 2)), empty((0, 2))
+        return array([], dtype=bool), empty((0, 2))
+    A = _stack([a.P for a, b in pairs])
+    B = _stack([b.P for a, b in pairs])
+    axes = concatenate((_stack([a.axes for a, b in pairs]),
+                        _stack([b.axes for a, b in pairs])), 1)
+    valid = (axes * axes).sum(2) > 0.5 # a degenerate edge has no axis
+
+    a_min, a_max = _project(A, axes)
+    b_min, b_max = _project(B, axes)
+    # overlap when b moves forward along the axis, or backward
+    forward = a_max - b_min
+    backward = b_max - a_min
+    depth = where(forward < backward, forward, backward)
+    depth = where(valid, depth, inf)
+    hits = (depth > 0).all(1)
+
+    # the axis of least overlap gives the minimum translation vector
+    rows = arange(N)
+    k = depth.argmin(1)
+    d = where(forward[rows, k] < backward[rows, k], depth[rows, k],
+              -depth[rows, k])
+    mtv = axes[rows, k] * (d * hits)[:, None]
+    if separating: return hits, mtv, axes[rows, k]
+    return hits, mtv
+
+
+def collidesegments(polygons, segments):
+    """
+    test many line segments, each against one polygon, in one vectorized pass.
+    a segment whose ends are the same point tests that point, which replaces
+    Polygon.collidepoint for the points inside a polygon
+
+    the segment is clipped against the half plane behind every edge of its
+    polygon (Cyrus-Beck); it enters the polygon when some part of it is left
+
+    arguments:
+    polygons -- a sequence of N Polygon objects
+    segments -- an N x 2 x 2 array of segments ((p_x, p_y), (q_x, q_y))
+
+    returns:
+    hits -- a boolean array, True for each segment that enters its polygon
+    t -- an array of where each segment first enters its polygon, as the
+      fraction of the way from p to q; 0 when p is inside, and 1 for the
+      segments that miss
+    """
+    N = len(polygons)
+    if not N: return array([], dtype=bool), empty(0)
+    P = _stack([polygon.P for polygon in polygons])
+    edges = _stack([polygon.edges for polygon in polygons])
+    segments = array(segments, dtype=float).reshape(N, 2, 2)
+    p = segments[:, 0]
+    d = segments[:, 1] - p
+
+    # the outward normals of the edges of polygons in CCW order
+    normals = empty(edges.shape)
+    normals[:, :, 0] = -edges[:, :, 1]
+    normals[:, :, 1] = edges[:, :, 0]
+    valid = (normals * normals).sum(2) > _MACHEPS # a degenerate edge has none
+
+    # p + t * d is behind edge k while den[k] * t < num[k]
+    num = (normals * (P - p[:, None])).sum(2)
+    den = (normals * d[:, None]).sum(2)
+    with errstate(divide='ignore', invalid='ignore'):
+        bound = num / den
+    entering = valid & (den < 0)
+    leaving = valid & (den > 0)
+    parallel = valid & (den == 0)
+    t0 = where(entering, bound, 0).max(1)
+    t1 = where(leaving, bound, 1).min(1)
+    # a segment parallel to an edge must start behind it
+    hits = (t0 < t1) & ~(parallel & (num <= 0)).any(1)
+    return hits, where(hits, t0, 1)
+
+
+def castpoints(polygons, points, motions):
+    """
+    cast many points along their motions, each against one polygon, for
+    continuous collision detection; the batched form of Polygon.raycast for a
+    point cast against a polygon that does not rotate.  a moving polygon is
+    cast against by giving the motion of the point relative to it
+
+    arguments:
+    polygons -- a sequence of N Polygon objects
+    points -- an N x 2 array of the points where their motions start
+    motions -- an N x 2 array of the motions of the points
+
+    returns:
+    hits -- a boolean array, True for each point that hits its polygon
+    toi -- an array of the times of impact, as the fraction of the motion done
+      when the point reaches its polygon; 1 for the points that miss
+    """
+    points = array(points, dtype=float).reshape(-1, 2)
+    motions = array(motions, dtype=float).reshape(-1, 2)
+    segments = empty((len(points), 2, 2))
+    segments[:, 0] = points
+    segments[:, 1] = points + motions
+    return collidesegments(polygons, segments)
@@ -8,7 +8,7 @@ polygon object
 from __future__ import division
 from operator import mul
 
-from numpy import array, cos, dot, fabs, lexsort, pi, sin, sqrt, vstack
+from numpy import array, cos, dot, fabs, inf, lexsort, pi, sin, sqrt, vstack
 
 from .convexhull import convexhull
 
@@ -88,8 +88,8 @@ class _Support(object):
         # find the point on the convex hull of C closest to q by iteratively
         #   searching around voronoi regions
         # i is the index of the initial test edge
-        # returns the point closest to q and sets self.M to be the minimum set
-        #   of points in C such that q in conv(points)
+        # returns the vector from q to the closest point and sets self.M to be
+        #   the minimum set of points in C such that q in conv(points)
         A = array(list(self))
         if len(A) > 1:
             I = convexhull(A)
@@ -113,7 +113,7 @@ class _Support(object):
                 if i in checked:
                     if not i in inside:
                         self.M = [self.M[I[i]]]
-                        return p - q
+                        return p
                     i = (i - 1) % n
                 continue
             if vprj > len2: # q lies CCW of edge
@@ -122,7 +122,7 @@ class _Support(object):
                     if not i in inside:
                         p = P[i]
                         self.M = [self.M[I[i]]]
-                        return p - q
+                        return p
                     i = (i + 1) % n
                 continue
 
@@ -130,7 +130,7 @@ class _Support(object):
             # perp of CCW edges will always point "outside"
             if nprj > 0: # q is "inside" the edge
                 inside.add(i)
-                if len(checked) == n: return q # q in C
+                if len(checked) == n: return array([0, 0]) # q in C
                 i = (i + 1) % n
                 continue
 
@@ -179,6 +179,12 @@ class Polygon(object):
             q = P[(i + 1) % n] # x, y of next point in series
             edges.append(p - q)
         self.edges = array(edges)
+        # the separating axes, the unit perpendiculars of the edges; a
+        # degenerate edge has the zero axis
+        lengths = sqrt((self.edges ** 2).sum(1))
+        lengths[lengths <= _MACHEPS] = inf
+        self.axes = array([-self.edges[:, 1], self.edges[:, 0]]).T / \
+            lengths.reshape(-1, 1)
         C = self.C
         # longest distance from C for all p in P
         self.rmax = sqrt(max(dot(C - p, C - p) for p in P))
@@ -221,6 +227,25 @@ class Polygon(object):
         return Polygon([(x + p_x, y + p_y) for (p_x, p_y) in self.P])
 
 
+    def transform(self, x, y, theta):
+        """
+        return a new polygon rotated theta radians around (0, 0) and then moved
+        by x, y.  the convex hull, area, rmax and axes of self are reused rather
+        than recomputed, so self should already be centered on (0, 0)
+        """
+        c, s = cos(theta), sin(theta)
+        A = array([[c, s],   # rotation matrix for row vectors
+                   [-s, c]])
+        other = Polygon.__new__(Polygon)
+        other.P = dot(self.P, A) + (x, y)
+        other.n = self.n
+        other.a = self.a
+        other.edges = dot(self.edges, A)
+        other.axes = dot(self.axes, A)
+        other.rmax = self.rmax
+        return other
+
+
     def move_ip(self, x, y):
         """move the polygon by x, y"""
         self.P = array([(x + p_x, y + p_y) for (p_x, p_y) in self.P])
@@ -3,15 +3,61 @@ from PodSixNet.Server import Server
 
 from PodSixNet.Connection import ConnectionListener, connection
 from time import time, sleep
+from numpy import array, flatnonzero, ones, zeros
+from pylygon import castpoints, collidepolys, collidesegments, separated
 
 from player import Player
-from entity import Entity
+from entity import Entity, COLLIDE_SIZE
+from collision import AxisCache, collision_stats
+from broadphase import SpatialHash, near_segments, nearby
+from world import World
+from snapshot import DeadReckoning, SnapshotHistory
+from priority import PriorityBudget
+from codec import pack_updates
 
-FPS = 30
 DEBUG = False
 
+# Physics runs in fixed steps at SIM_HZ, and the world is sent to the
+# clients at NET_HZ. After a stall at most MAX_STEPS steps are run to catch
+# up, the rest of the lost time is dropped.
+SIM_HZ = 60
+NET_HZ = 20
+MAX_STEPS = 5
+
+# With nobody connected the world waits, and the network is only polled at
+# IDLE_HZ.
+IDLE_HZ = 5
+
+# Run the network and the fixed steps on an asyncio event loop instead of
+# polling asyncore between sleeps.
+ASYNCIO = False
+if ASYNCIO:
+    from PodSixNet.Protocol import Channel, Server
+
+# Keep entity state in NumPy arrays and update it all at once.
+WORLD_STORE = False
+
 SYSTEM_SIZE = 1000
 
+# Clients only get updates for entities this close to their ship, or for
+# everything when None.
+INTEREST_RADIUS = 800
+
+# Delta clients only get an entity again once their extrapolation of the
+# last record is off by more than POSITION_ERROR pixels or ANGLE_ERROR
+# degrees, its controls changed, or KEYFRAME ticks went by.
+POSITION_ERROR = 4
+ANGLE_ERROR = 5
+KEYFRAME = SIM_HZ
+
+# Bytes per second each delta client may be sent, and the rough size of a
+# record in an update. The most important changes go out first, the rest
+# wait for a later broadcast. A client whose last updates have not left
+# yet skips state updates until it catches up.
+BANDWIDTH = 32000
+RECORD_BYTES = 100
+PACKED_BYTES = 17
+
 class ClientChannel(Channel):
     
     def __init__(self, *args, **kwargs):
@@ -19,10 +65,30 @@ class ClientChannel(Channel):
         self.functions = self._server.functions
         self.player = Player(self.functions)
         self.functions['add_entity'](self.player, etype='collided')
+        
+        # Optional protocol features the client supports.
+        self.features = set()
+        reckoning = DeadReckoning(1.0 / SIM_HZ, POSITION_ERROR, ANGLE_ERROR,
+                                  KEYFRAME)
+        budget = PriorityBudget(self.player, BANDWIDTH / NET_HZ, RECORD_BYTES)
+        self.history = SnapshotHistory(reckoning, budget)
+        
+        # Entities in the last full update sent to the client.
+        self.visible = set()
     
     def update(self, delta_time):
         return self.player.update(delta_time)
     
+    def send_player(self):
+        "Push the player info if it changed since it was last sent."
+        player = self.player
+        if player.info_changed:
+            player.info_changed = False
+            self.Send({
+                'action': 'player',
+                'info': player.get_info(),
+            })
+    
     def Close(self):
         "Called when a player disconnects."
         self.functions['remove_entity'](self.player)
@@ -33,12 +99,61 @@ class ClientChannel(Channel):
             print data
     
     def Network_player(self, data):
+        "Answer clients that still ask for their player info."
         action = {
             'action': 'player',
             'info': self.player.get_info(),
         }
         self.Send(action)
 
+    def Network_features(self, data):
+        if 'features' in data:
+            self.features = set(data['features'])
+            if 'packed' in self.features:
+                self.history.budget.record_size = PACKED_BYTES
+    
+    def Network_ack(self, data):
+        if 'tick' in data:
+            self.history.ack(data['tick'])
+    
+    def pack(self, action):
+        "Pack the updates of an action if the client can read packed records."
+        if 'packed' in self.features:
+            action = dict(action)
+            action['packed'] = pack_updates(action.pop('updates'))
+        return action
+    
+    def send_snapshot(self, tick, snapshot):
+        "Send the changes since the last snapshot the client acknowledged."
+        # Only the newest state is written once the client has caught up,
+        # so don't build one while it is still behind.
+        if self.Backlog() > BANDWIDTH / NET_HZ:
+            return
+        
+        # Packed records always hold every field.
+        whole = 'packed' in self.features
+        steered = self._server.steered
+        action = self.history.update(tick, snapshot, whole, steered)
+        self.SendState(self.pack(action))
+    
+    def send_visible(self, tick, updates):
+        "Send a full update, and delete what is no longer visible."
+        visible = set(u['object_id'] for u in updates)
+        for object_id in self.visible - visible:
+            self.Send({
+                'action': 'delete',
+                'object_id': object_id,
+                'tick': tick,
+            })
+        self.visible = visible
+        
+        action = {
+            'action': 'update',
+            'tick': tick,
+            'updates': updates,
+        }
+        self.SendState(self.pack(action))
+    
     def Network_name(self, data):
         if 'name' in data:
             self.player.name = data['name']
@@ -77,15 +192,31 @@ class ClientChannel(Channel):
         if 'controls' in data:
             controls = data['controls']
             self.player.new_controls(controls)
+            self._server.steered.add(self.player.object_id)
 
 
 class DFServer(Server):
 
     channelClass = ClientChannel
+    offerFraming = True
+    offerDatagrams = True
     
     def __init__(self, *args, **kwargs):
         Server.__init__(self, *args, **kwargs)
         self.id_inc = 0
+        self.tick_count = 0
+        
+        # Updates of the last simulation step, sent by broadcast().
+        self.updates = []
+        self.step_time = 1.0 / SIM_HZ
+        
+        # Weapons fired since the last broadcast, and the ids of the weapons
+        # in flight. Clients with the spawn feature fly them on their own.
+        self.spawns = []
+        self.flying = set()
+        
+        # Ids of the players whose controls changed since the last broadcast.
+        self.steered = set()
         
         self.clients = []
         self.entities = []
@@ -96,78 +227,412 @@ class DFServer(Server):
         # Entites that hit.
         self.colliders = []
         
+        # Broadphase grid of the entities that can be hit.
+        self.grid = SpatialHash(SYSTEM_SIZE, COLLIDE_SIZE)
+        
+        # Axes that separated the candidate pairs in the last step.
+        self.axis_cache = AxisCache()
+        
+        # Array store for the entity state, if enabled.
+        self.world = None
+        if WORLD_STORE:
+            self.world = World(SYSTEM_SIZE)
+        
         # Static Objects in space.
         # Functions for the entities.
         self.functions = {
             'new_id': self.get_id,
             'add_entity': self.add_entity,
             'remove_entity': self.remove_entity,
+            'move_entity': self.grid.move,
             'system_size': SYSTEM_SIZE,
         }
         
         # A Planet to respawn at:
         planet = Entity(self.functions)
         planet.type = 'planet'
-        self.entities.append(planet)
+        self.add_entity(planet)
     
-    def tick(self, fps):
+    def step(self, delta_time):
+        "Advance the simulation by one fixed step."
+        self.step_time = delta_time
         entities = self.entities
-        collided = self.collided
-        colliders = self.colliders
+        world = self.world
         
-        # Test collisions
-        for projectile in colliders:
-            polygon = projectile.polygon
-            for entity in collided:
-                result = entity.test_collision(polygon)
-                if result:
-                    entity.hit_by(projectile)
-                    projectile.hit()
-                    break
+        self.collide()
         
         # Update all the players.
-        updates = []
-        for e in entities:
-            updates.append(e.update(fps))
+        if world:
+            updates = self.update_world(delta_time)
+        
+        else:
+            updates = []
+            for e in list(entities):
+                updates.append(e.update(delta_time))
+        
+        self.updates = [u for u in updates if u]
+        self.tick_count += 1
+    
+    def collide(self):
+        "Find the entities the projectiles hit, and hit them."
+        axis_cache = self.axis_cache
+        
+        # Gather the entities in neighbouring cells of every projectile whose
+        # bounding circles overlap it. Projectiles collide with their polygon
+        # or, when they have one, the segment they swept. Those with
+        # continuous collision detection cast it against the entities where
+        # they were at the start of the step, so the circles grow by how far
+        # the entities moved since, and the grid is searched as far as the
+        # fastest of them moved. Positions are read once per step, from
+        # the world arrays when it is enabled and the grid for the entities.
+        grid = self.grid
+        places = grid.places
+        colliders = self.colliders
+        if self.world:
+            positions = self.world.positions(colliders)
+        else:
+            positions = [(p.pos_x, p.pos_y) for p in colliders]
+        
+        fastest = None
+        entered = 0
+        pairs = []
+        polygon_pairs = []
+        polygons = []
+        cached = []
+        segment_pairs = []
+        targets = []
+        segments = []
+        cast_pairs = []
+        casts = []
+        points = []
+        motions = []
+        for projectile, (x, y) in zip(colliders, positions):
+            duration = 0
+            search = 0
+            if getattr(projectile, 'ccd', False):
+                duration = projectile.sweep_time
+                if fastest is None:
+                    fastest = max([e.speed for e in self.collided] or [0])
+                search = fastest * duration
+            radius = projectile.shape.radius
+            swept = None
+            
+            for entity, offset in grid.query(projectile, x, y, search):
+                if entity.ignores(projectile):
+                    continue
+                
+                entered += 1
+                pair = (projectile, entity)
+                axis = axis_cache.get(pair)
+                
+                # Entity.bounds_overlap, without reading the positions again.
+                ox, oy = offset
+                ex, ey = places[entity]
+                dx = x + ox - ex
+                dy = y + oy - ey
+                reach = radius + entity.shape.radius
+                if duration:
+                    reach += entity.speed * duration
+                if dx * dx + dy * dy > reach * reach:
+                    if axis is not None:
+                        axis_cache.keep(pair, axis)
+                    continue
+                
+                # The segment only moves with the offset, so it is read once.
+                if swept is None:
+                    swept = (projectile.segment(),)
+                segment = swept[0]
+                if segment is not None:
+                    (x0, y0), (x1, y1) = segment
+                    segment = ((x0 + ox, y0 + oy), (x1 + ox, y1 + oy))
+                
+                if segment is None:
+                    polygon_pairs.append(len(pairs))
+                    polygons.append((entity.polygon,
+                                     projectile.placed_polygon(offset)))
+                    cached.append(axis)
+                elif duration:
+                    # The point starts as far behind the entity as the entity
+                    # moved, and flies relative to it.
+                    (x0, y0), (x1, y1) = segment
+                    dx = entity.vel_x * duration
+                    dy = entity.vel_y * duration
+                    cast_pairs.append(len(pairs))
+                    casts.append(entity.polygon)
+                    points.append((x0 + dx, y0 + dy))
+                    motions.append((x1 - x0 - dx, y1 - y0 - dy))
+                else:
+                    segment_pairs.append(len(pairs))
+                    targets.append(entity.polygon)
+                    segments.append(segment)
+                pairs.append(pair)
+        
+        collision_stats.count('bounds', entered, entered - len(pairs))
+        hits = zeros(len(pairs), bool)
+        
+        # When in the step the segments and casts hit, as a fraction of it.
+        times = zeros(len(pairs))
+        timed = zeros(len(pairs), bool)
+        if polygon_pairs:
+            hits[polygon_pairs] = self.collide_polygons(
+                [pairs[i] for i in polygon_pairs], polygons, cached)
+        axis_cache.end_step()
+        
+        if segment_pairs:
+            found, entered_at = collidesegments(targets, segments)
+            collision_stats.count('segment', len(segments),
+                                  len(segments) - int(found.sum()))
+            hits[segment_pairs] = found
+            times[segment_pairs] = entered_at
+            timed[segment_pairs] = True
+        
+        if cast_pairs:
+            found, impact_times = castpoints(casts, points, motions)
+            collision_stats.count('cast', len(casts),
+                                  len(casts) - int(found.sum()))
+            hits[cast_pairs] = found
+            times[cast_pairs] = impact_times
+            timed[cast_pairs] = True
+        
+        # A projectile hits the entity it reached first in the step.
+        first = {}
+        order = []
+        for i in flatnonzero(hits):
+            projectile = pairs[i][0]
+            if projectile not in first:
+                first[projectile] = i
+                order.append(projectile)
+            elif times[i] < times[first[projectile]]:
+                first[projectile] = i
+        
+        for projectile in order:
+            i = first[projectile]
+            pairs[i][1].hit_by(projectile)
+            if timed[i]:
+                projectile.hit(times[i])
+            else:
+                projectile.hit()
+    
+    def collide_polygons(self, pairs, polygons, cached):
+        """
+        Return which pairs of polygons collide. The axis that separated a
+        pair in the last step is tried first, the rest are tested exactly
+        together.
+        """
+        axis_cache = self.axis_cache
+        hits = zeros(len(pairs), bool)
+        exact = ones(len(pairs), bool)
+        known = flatnonzero([axis is not None for axis in cached])
+        if len(known):
+            apart = known[separated([polygons[i] for i in known],
+                                    [cached[i] for i in known])]
+            collision_stats.count('cached', len(known), len(apart))
+            exact[apart] = False
+            for i in apart:
+                axis_cache.keep(pairs[i], cached[i])
+        
+        tested = flatnonzero(exact)
+        if len(tested):
+            found, mtv, axes = collidepolys([polygons[i] for i in tested],
+                                            separating=True)
+            collision_stats.count('exact', len(tested),
+                                  len(tested) - int(found.sum()))
+            hits[tested] = found
+            for i, axis in zip(tested[~found], axes[~found]):
+                axis_cache.keep(pairs[i], axis)
+        return hits
+    
+    def broadcast(self):
+        "Send the state of the last step, stamped with its tick number."
+        flown = []
+        streamed = []
+        for c in self.clients:
+            c.send_player()
+            if 'spawn' in c.features:
+                flown.append(c)
+            else:
+                streamed.append(c)
+        
+        self.send_spawns(flown)
+        if flown:
+            flying = self.flying
+            updates = [u for u in self.updates if u['object_id'] not in flying]
+            self.send_state(updates, flown)
+        
+        if streamed:
+            self.send_state(self.updates, streamed)
+        
+        self.steered.clear()
+    
+    def send_state(self, updates, clients):
+        "Send the updates to the clients, near their ship if limited."
+        if INTEREST_RADIUS is None:
+            self.send_updates(updates, clients)
+        else:
+            self.send_interest(updates, clients)
+    
+    def send_spawns(self, clients):
+        "Tell the clients about the weapons fired since the last broadcast."
+        spawns = self.spawns
+        self.spawns = []
+        if not spawns or not clients:
+            return
+        
+        step_time = self.step_time
+        spawns = [w.get_spawn((self.tick_count - w.spawn_tick) * step_time)
+                  for w in spawns]
+        action = {
+            'action': 'spawn',
+            'tick': self.tick_count,
+            'spawns': spawns,
+        }
+        if INTEREST_RADIUS is None:
+            self.SendToAll(action, clients)
+            return
+        
+        # A weapon is sent to the clients whose area any part of its flight
+        # passes through, so those it flies in to hit know about it too.
+        starts = array([(w['pos_x'], w['pos_y']) for w in spawns])
+        flights = array([(w['vel_x'] * w['life_time'],
+                          w['vel_y'] * w['life_time']) for w in spawns])
+        ends = starts + flights
+        for c in clients:
+            player = c.player
+            mask = near_segments(starts, ends, player.pos_x, player.pos_y,
+                                 INTEREST_RADIUS, SYSTEM_SIZE)
+            if mask.any():
+                visible = dict(action)
+                visible['spawns'] = [spawns[i] for i in flatnonzero(mask)]
+                c.Send(visible)
+    
+    def send_updates(self, updates, clients):
+        "Send every update to each of the clients."
+        # Send the full updates to clients without delta support, and each
+        # delta client what changed since its last acknowledged snapshot.
+        full = []
+        packed = []
+        deltas = []
+        for c in clients:
+            if 'delta' in c.features:
+                deltas.append(c)
+            elif 'packed' in c.features:
+                packed.append(c)
+            else:
+                full.append(c)
         
-        # Send the updates to everyone.
         action = {
             'action': 'update',
+            'tick': self.tick_count,
             'updates': updates,
         }
-        self.send_all(action)
+        if full:
+            self.SendToAll(action, full, state=True)
+        
+        if packed:
+            self.SendToAll(packed[0].pack(action), packed, state=True)
+        
+        if deltas:
+            snapshot = dict((u['object_id'], u) for u in updates)
+            for c in deltas:
+                c.send_snapshot(self.tick_count, snapshot)
+    
+    def send_interest(self, updates, clients):
+        "Send each client the updates of the entities close to its ship."
+        if not updates:
+            return
+        
+        positions = array([(u['pos_x'], u['pos_y']) for u in updates])
+        for c in clients:
+            player = c.player
+            mask = nearby(positions, player.pos_x, player.pos_y,
+                          INTEREST_RADIUS, SYSTEM_SIZE)
+            visible = [updates[i] for i in flatnonzero(mask)]
+            
+            # Entities entering or leaving the area are created or removed
+            # by the delta itself.
+            if 'delta' in c.features:
+                snapshot = dict((u['object_id'], u) for u in visible)
+                c.send_snapshot(self.tick_count, snapshot)
+            else:
+                c.send_visible(self.tick_count, visible)
+    
+    def update_world(self, delta_time):
+        "Update every entity at once with the world store."
+        for e in self.world.step(delta_time):
+            self.remove_entity(e)
+        
+        # Fire after the step, so new weapons start at their origin on the
+        # next tick like they do without the world store.
+        for c in self.clients:
+            c.player.update_weapon(delta_time)
+        
+        # The grid is kept up to date by Entity.move, which the world skips.
+        collided = self.collided
+        for e, (x, y) in zip(collided, self.world.positions(collided)):
+            self.grid.move(e, x, y)
+        
+        return self.world.updates()
     
     def add_entity(self, entity, etype=''):
         self.entities.append(entity)
+        if self.world:
+            self.world.attach(entity)
+        
         if etype == 'collider':
             self.colliders.append(entity)
+            
+            # It is at its origin once this step is over.
+            entity.spawn_tick = self.tick_count + 1
+            self.spawns.append(entity)
+            self.flying.add(entity.object_id)
         
         elif etype == 'collided':
             self.collided.append(entity)
+            self.grid.add(entity)
     
     def remove_entity(self, entity):
+        # Updates up to this tick may still hold the entity.
         action = {
             'action': 'delete',
             'object_id': entity.object_id,
+            'tick': self.tick_count,
         }
-        self.send_all(action)
+        if entity.object_id in self.flying:
+            self.flying.remove(entity.object_id)
+            
+            # Clients flying the weapon only need to hear that it stopped
+            # early, and nothing if it never reached them.
+            if entity in self.spawns:
+                self.spawns.remove(entity)
+                stopped = False
+            else:
+                stopped = entity.hit_target
+            
+            clients = [c for c in self.clients
+                       if stopped or 'spawn' not in c.features]
+            self.SendToAll(action, clients)
+        
+        else:
+            self.send_all(action)
         if entity in self.entities:
             self.entities.remove(entity)
+            if self.world:
+                self.world.detach(entity)
         
         if entity in self.colliders:
             self.colliders.remove(entity)
         
         if entity in self.collided:
             self.collided.remove(entity)
+            self.grid.remove(entity)
     
     def get_id(self):
         self.id_inc += 1
         return self.id_inc
     
     def send_all(self, action):
-        clients = self.clients
-        for c in clients:
-            c.Send(action)
+        "Send an action to every client, encoding it only once."
+        self.SendToAll(action, self.clients)
 
     def Connected(self, channel, addr):
         self.clients.append(channel)
@@ -177,41 +642,62 @@ class DFServer(Server):
         self.clients.remove(client)
 
 
-running = True
-server = DFServer(localaddr=('', 34002))
-dyn_fps = FPS
-real_fps = lambda x: 1.0 / x
-frame_time = real_fps(dyn_fps)
-last_time = 0
-while running:
-    # Set server to idle mode if no players are connected.
-    if (len(server.clients) == 0):
-        dyn_fps = 5
-    
-    currentTime = time()
-    frame_time = currentTime - last_time
-    last_time = currentTime
-    # Tick Update
-    server.Pump()
-    server.tick(frame_time)                
+if __name__ == '__main__':
+    server = DFServer(localaddr=('', 34002))
+    step_time = 1.0 / SIM_HZ
+    send_time = 1.0 / NET_HZ
     
+    def step():
+        if server.clients:
+            server.step(step_time)
     
-    #Simulate server lag:
-    #sleep(0.2) # 200MS! Ridiculous!
-    
-    time_taken = time() - currentTime
-    time_left = real_fps(dyn_fps) - time_taken
-    # print frame_time, time_taken, time_left
-    
-    if time_left < 0:
-        # If lagging behind, adjust FPS to handle the load.
-        dyn_fps -= 0.5
-        print 'Warning, lagging:', time_left
-        continue
+    def broadcast():
+        if server.clients:
+            server.broadcast()
     
+    if ASYNCIO:
+        # The event loop calls the steps and broadcasts when they are due.
+        server.Schedule(step, step_time, MAX_STEPS)
+        server.Schedule(broadcast, send_time)
+        server.Run()
     else:
-        # Slowly increase the FPS until it reaches the max FPS.
-        if dyn_fps < FPS:
-            dyn_fps += 0.1
-        
-        sleep(time_left)
+        # Wall clock time the simulation and the network have caught up to.
+        sim_time = send_at = time()
+        running = True
+        while running:
+            # Output is written once per broadcast, see below.
+            server.Pump(flush=False)
+            
+            if not server.clients:
+                server.Flush()
+                sleep(1.0 / IDLE_HZ)
+                sim_time = send_at = time()
+                continue
+            
+            now = time()
+            steps = 0
+            while sim_time + step_time <= now:
+                if steps == MAX_STEPS:
+                    print 'Warning, lagging:', now - sim_time
+                    sim_time = now
+                    break
+                
+                server.step(step_time)
+                sim_time += step_time
+                steps += 1
+            
+            if now >= send_at:
+                server.broadcast()
+                server.Flush()
+                send_at += send_time
+                
+                # Skip the sends that were missed instead of bursting them.
+                if send_at < now:
+                    send_at = now + send_time
+            
+            #Simulate server lag:
+            #sleep(0.2) # 200MS! Ridiculous!
+            
+            time_left = min(sim_time + step_time, send_at) - time()
+            if time_left > 0:
+                sleep(time_left)
@@ -0,0 +1,36 @@
+from math import radians
+
+from pylygon.polygon import Polygon
+
+
+class Shape(object):
+    """
+    Collision shape stored once in local space, centered on its centroid.
+    Entities place it in the world with their position and angle.
+    """
+    
+    def __init__(self, points):
+        polygon = Polygon(points)
+        self.polygon = polygon.move(*-polygon.C)
+        
+        # Bounding radius around the centroid.
+        self.radius = self.polygon.rmax
+    
+    def place(self, x, y, angle):
+        """
+        Return the shape as a world space polygon. Angles are in degrees
+        clockwise, the same way the ships are drawn.
+        """
+        return self.polygon.transform(x, y, -radians(angle))
+
+
+class PointShape(object):
+    """
+    Collision shape of a projectile, which collides as a point or as the
+    segment it swept in the last step, without any polygon. The radius
+    reaches back along that segment, for the broadphase and the bounding
+    circle test.
+    """
+    
+    def __init__(self, radius=0):
+        self.radius = radius
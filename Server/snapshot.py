@@ -0,0 +1,194 @@
+# Snapshots kept per client while waiting for an acknowledgement.
+HISTORY = 32
+
+
+def delta(base, current, whole=False):
+    """
+    Return the updates going from the base snapshot to the current one,
+    and the ids that were removed. New entities get their whole record,
+    others only the fields that changed, or their whole record if whole
+    is set.
+    """
+    updates = []
+    for object_id, record in current.iteritems():
+        old = base.get(object_id)
+        if old is None:
+            updates.append(record)
+            continue
+
+        if old is record:
+            continue
+
+        changed = {}
+        for key, value in record.iteritems():
+            if old.get(key) != value:
+                changed[key] = value
+
+        if changed and whole:
+            updates.append(record)
+        elif changed:
+            changed['object_id'] = object_id
+            updates.append(changed)
+
+    removed = [object_id for object_id in base if object_id not in current]
+    return updates, removed
+
+
+class DeadReckoning(object):
+    """
+    The records last sent to one client. Clients keep moving entities along
+    their last velocities, so a record is only sent again once that guess
+    is too far off, the entity was steered, or keyframe ticks went by.
+    """
+
+    def __init__(self, tick_time, position_error, angle_error, keyframe):
+        self.tick_time = tick_time
+        self.position_error = position_error
+        self.angle_error = angle_error
+        self.keyframe = keyframe
+        self.sent = {}
+
+    def reset(self, tick, snapshot):
+        "The client got every record of this snapshot."
+        self.sent = dict((object_id, (tick, record))
+                         for object_id, record in snapshot.iteritems())
+
+    def commit(self, tick, current, snapshot):
+        "Remember the records of current that are sent with the snapshot."
+        sent = self.sent
+        for object_id, record in snapshot.iteritems():
+            if record is current.get(object_id):
+                sent[object_id] = (tick, record)
+
+        for object_id in [i for i in sent if i not in current]:
+            del sent[object_id]
+
+    def close(self, old, record, elapsed):
+        "Is the extrapolation of the old record close enough to the new one?"
+        if old['vel_angle'] != record['vel_angle']:
+            return False
+
+        error = (abs(old['pos_x'] + old['vel_x'] * elapsed - record['pos_x']) +
+                 abs(old['pos_y'] + old['vel_y'] * elapsed - record['pos_y']))
+        if error > self.position_error:
+            return False
+
+        angle = old['angle'] + old['vel_angle'] * elapsed - record['angle']
+        return abs((angle + 180) % 360 - 180) <= self.angle_error
+
+    def predict(self, tick, snapshot, steered=()):
+        """
+        Return the snapshot with the records the client can predict replaced
+        by the ones it already has.
+        """
+        sent = self.sent
+        predicted = {}
+        for object_id, record in snapshot.iteritems():
+            last = sent.get(object_id)
+            if last is not None and object_id not in steered:
+                sent_tick, old = last
+                age = tick - sent_tick
+                if (age < self.keyframe and
+                        self.close(old, record, age * self.tick_time)):
+                    predicted[object_id] = old
+                    continue
+
+            predicted[object_id] = record
+        return predicted
+
+
+class SnapshotHistory(object):
+    "The snapshots sent to one client, and the last one it acknowledged."
+
+    def __init__(self, reckoning=None, budget=None):
+        self.snapshots = {}
+        self.acked = None
+        self.reckoning = reckoning
+        self.budget = budget
+
+    def ack(self, tick):
+        "The client has applied the snapshot of this tick."
+        if tick not in self.snapshots:
+            return
+
+        if self.acked is not None and tick <= self.acked:
+            return
+
+        self.acked = tick
+        for old in [t for t in self.snapshots if t < tick]:
+            del self.snapshots[old]
+
+    def defer(self, base, current, snapshot):
+        """
+        Keep the records that do not fit in the budget out of the snapshot,
+        the client keeps the last one it got for those.
+        """
+        changed = {}
+        for object_id, record in snapshot.iteritems():
+            if record is current[object_id] and base.get(object_id) != record:
+                changed[object_id] = record
+
+        chosen = self.budget.select(changed)
+        if len(chosen) == len(changed):
+            return snapshot
+
+        if self.reckoning is not None:
+            sent = self.reckoning.sent
+        else:
+            sent = {}
+
+        snapshot = dict(snapshot)
+        for object_id in changed:
+            if object_id in chosen:
+                continue
+
+            if object_id in sent:
+                snapshot[object_id] = sent[object_id][1]
+            elif object_id in base:
+                snapshot[object_id] = base[object_id]
+            else:
+                del snapshot[object_id]
+        return snapshot
+
+    def update(self, tick, snapshot, whole=False, steered=()):
+        """
+        Remember the snapshot of this tick and return the update action
+        to send for it, relative to the last acknowledged snapshot. Steered
+        holds the ids of entities whose controls changed.
+        """
+        # If the client stops acknowledging, start over with a full update.
+        if len(self.snapshots) >= HISTORY:
+            self.snapshots = {}
+            self.acked = None
+
+        if self.acked is None:
+            base = {}
+        else:
+            base = self.snapshots[self.acked]
+
+        # Full updates always send every fresh record.
+        reckoning = self.reckoning
+        if self.acked is None:
+            if reckoning is not None:
+                reckoning.reset(tick, snapshot)
+
+        else:
+            current = snapshot
+            if reckoning is not None:
+                snapshot = reckoning.predict(tick, snapshot, steered)
+
+            if self.budget is not None:
+                snapshot = self.defer(base, current, snapshot)
+
+            if reckoning is not None:
+                reckoning.commit(tick, current, snapshot)
+
+        updates, removed = delta(base, snapshot, whole)
+        self.snapshots[tick] = snapshot
+        return {
+            'action': 'update',
+            'tick': tick,
+            'base': self.acked,
+            'updates': updates,
+            'removed': removed,
+        }
@@ -0,0 +1,29 @@
+from math import ceil, cos, floor, sin, radians
+
+# Headings are quantized to a tenth of a degree.
+HEADING_STEPS = 3600
+HEADING_SCALE = HEADING_STEPS / 360.0
+
+SIN = [sin(radians(i / HEADING_SCALE)) for i in xrange(HEADING_STEPS)]
+COS = [cos(radians(i / HEADING_SCALE)) for i in xrange(HEADING_STEPS)]
+
+
+def heading(angle):
+    "Return the sine and cosine of an angle in degrees from the tables."
+    i = int(floor(angle * HEADING_SCALE + 0.5)) % HEADING_STEPS
+    return SIN[i], COS[i]
+
+
+def velocity_caps(angle, accel, max_speed):
+    """
+    Return the x and y velocity caps for a heading. These are the first
+    multiple of the acceleration along the heading whose speed
+    (abs(x) + abs(y)) reaches max_speed.
+    """
+    sin_a, cos_a = heading(angle)
+    step = abs(accel) * (abs(sin_a) + abs(cos_a))
+    if step == 0 or max_speed <= 0:
+        return 0, 0
+    
+    steps = ceil(max_speed / step)
+    return steps * sin_a * accel, steps * cos_a * accel
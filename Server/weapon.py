@@ -1,15 +1,101 @@
-from math import cos, sin, radians
+from math import cos, hypot, sin, radians
 from entity import Entity
+from shape import PointShape
+from trig import velocity_caps
 
 
 class Weapon(Entity):
     
+    # Collide as the segment flown in the last step instead of the collision
+    # box. The segment is as thin as the line the weapon flies, so shots
+    # that only graze a ship with their box miss.
+    swept = False
+    
+    # Cast the flight of each step against the entities it may hit as they
+    # moved in it, instead of where they are at its end. Needs swept.
+    ccd = False
+    
     def __init__(self, functions):
         Entity.__init__(self, functions)
         self.type = 'bullet'
         self.damage = 2
         self.max_life = 2
         self.life_time = self.max_life
+        
+        # Where and when it was fired, for how long it flies, and if it
+        # stopped before its life time ran out.
+        self.origin = (0, 0)
+        self.spawn_tick = 0
+        self.flight_time = self.life_time
+        self.hit_target = False
+        
+        # The entity that fired it, which it never hits.
+        self.owner = None
+        
+        # Length of a step, for the segment swept in it.
+        self.sweep_time = 0
+        
+        # Fraction of the last step at which it hit, when known.
+        self.impact_time = None
+    
+    def new_collide_size(self, collide_size):
+        "Swept weapons collide as a segment, without a collision box."
+        if not self.swept:
+            Entity.new_collide_size(self, collide_size)
+            return
+        
+        self.collide_size = collide_size
+        self.shape = PointShape()
+    
+    def launch(self, delta_time):
+        "Start flying at full speed from the current position and angle."
+        self.origin = (self.pos_x, self.pos_y)
+        self.flight_time = self.life_time
+        self.old_angle = self.angle
+        self.max_x, self.max_y = velocity_caps(self.angle,
+                                               self.accel * delta_time,
+                                               self.max_speed)
+        self.vel_x = self.max_x
+        self.vel_y = self.max_y
+        
+        if self.swept:
+            self.sweep_time = delta_time
+            self.shape = PointShape(hypot(self.vel_x, self.vel_y) * delta_time)
+    
+    def segment(self, offset=(0, 0)):
+        """
+        Return the segment flown in the last step, from where the weapon was
+        to where it is, moved by offset. Before the weapon first moves both
+        ends are its position. Weapons that are not swept collide with their
+        box and return None.
+        """
+        if not self.swept:
+            return None
+        
+        flown = min(self.sweep_time, self.flight_time - self.life_time)
+        x = self.pos_x + offset[0]
+        y = self.pos_y + offset[1]
+        return ((x - self.vel_x * flown, y - self.vel_y * flown), (x, y))
+    
+    def get_spawn(self, age):
+        """
+        Return everything a client needs to fly the weapon itself, age
+        seconds after it was fired.
+        """
+        pos_x, pos_y = self.origin
+        data = {
+            'object_id': self.object_id,
+            'type': self.type,
+            'pos_x': pos_x,
+            'pos_y': pos_y,
+            'angle': self.angle,
+            'vel_x': self.vel_x,
+            'vel_y': self.vel_y,
+            'life_time': self.flight_time,
+            'tick': self.spawn_tick,
+            'age': age,
+        }
+        return data
     
     def get_info(self):
         "Return information regarding the player."
@@ -23,9 +109,14 @@ class Weapon(Entity):
         }
         return data
         
-    def hit(self):
-        "Set life time to zero so it doesn't continue to fly."
+    def hit(self, impact_time=None):
+        """
+        Set life time to zero so it doesn't continue to fly. The impact time
+        is the fraction of the last step at which it hit, if known.
+        """
         self.life_time = 0
+        self.hit_target = True
+        self.impact_time = impact_time
         
     def update(self, delta_time):
         "Update the movement and life time of the weapon."
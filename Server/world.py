@@ -0,0 +1,288 @@
+from numpy import (abs as fabs, array, ceil, errstate, flatnonzero, floor,
+                   maximum, where, zeros)
+
+from trig import COS, HEADING_SCALE, HEADING_STEPS, SIN
+
+# Arrays kept by the world, with their columns and type.
+ARRAYS = (
+    ('pos', 2, float),
+    ('vel', 2, float),
+    ('caps', 2, float),
+    ('angle', 1, float),
+    ('vel_angle', 1, float),
+    ('old_angle', 1, float),
+    ('accel', 1, float),
+    ('max_speed', 1, float),
+    ('turn_rate', 1, float),
+    ('speed', 1, float),
+    ('health', 1, int),
+    ('life_time', 1, float),
+    ('thrust', 1, int),
+    ('turning', 1, int),
+    ('expires', 1, bool),
+)
+
+# Entity attributes that live in a world row: attribute -> (array, column).
+FIELDS = {
+    'pos_x': ('pos', 0),
+    'pos_y': ('pos', 1),
+    'vel_x': ('vel', 0),
+    'vel_y': ('vel', 1),
+    'max_x': ('caps', 0),
+    'max_y': ('caps', 1),
+    'angle': ('angle', None),
+    'vel_angle': ('vel_angle', None),
+    'old_angle': ('old_angle', None),
+    'accel': ('accel', None),
+    'max_speed': ('max_speed', None),
+    'turn_rate': ('turn_rate', None),
+    'speed': ('speed', None),
+    'health': ('health', None),
+    'life_time': ('life_time', None),
+}
+
+# Controls that live in a world row, the rest stay in a dict.
+CONTROLS = ('thrust', 'turning')
+
+# The same heading tables as the entities use.
+SIN_TABLE = array(SIN)
+COS_TABLE = array(COS)
+
+
+def _row_property(name, column):
+    "Attribute that reads and writes an entity's row in a world array."
+    if column is None:
+        def fget(self):
+            return getattr(self.world, name).item(self.row)
+
+        def fset(self, value):
+            getattr(self.world, name)[self.row] = value
+
+    else:
+        def fget(self):
+            return getattr(self.world, name).item(self.row, column)
+
+        def fset(self, value):
+            getattr(self.world, name)[self.row, column] = value
+
+    return property(fget, fset)
+
+
+class EntityView(object):
+    "Mixin for entities whose movement state is stored in a World row."
+
+for _field, (_name, _column) in FIELDS.items():
+    setattr(EntityView, _field, _row_property(_name, _column))
+
+_views = {}
+
+def view_class(cls):
+    "Return the row backed version of an entity class."
+    if cls not in _views:
+        _views[cls] = type(cls.__name__, (EntityView, cls), {})
+    return _views[cls]
+
+
+class RowControls(object):
+    "Controls of an entity, with thrust and turning kept in the world arrays."
+
+    def __init__(self, entity, controls):
+        self.entity = entity
+        self.others = {}
+        for key, value in controls.items():
+            self[key] = value
+
+    def __getitem__(self, key):
+        if key in CONTROLS:
+            entity = self.entity
+            return getattr(entity.world, key).item(entity.row)
+        return self.others[key]
+
+    def __setitem__(self, key, value):
+        if key in CONTROLS:
+            entity = self.entity
+            getattr(entity.world, key)[entity.row] = value
+        else:
+            self.others[key] = value
+
+    def __contains__(self, key):
+        return key in CONTROLS or key in self.others
+
+    def copy(self):
+        controls = dict(self.others)
+        for key in CONTROLS:
+            controls[key] = self[key]
+        return controls
+
+
+class World(object):
+    """
+    Structure of arrays store for all entities. Entities added to the world
+    become views over one row, and step() integrates the whole world at once.
+    """
+
+    def __init__(self, system_size, capacity=64):
+        self.system_size = system_size
+        self.count = 0
+        self.capacity = 0
+        self.entities = []
+        self.grow(capacity)
+
+    def grow(self, capacity):
+        "Reallocate the arrays to hold at least capacity rows."
+        count = self.count
+        for name, columns, kind in ARRAYS:
+            shape = (capacity, columns) if columns > 1 else (capacity,)
+            array = zeros(shape, dtype=kind)
+            if count:
+                array[:count] = getattr(self, name)[:count]
+            setattr(self, name, array)
+        self.capacity = capacity
+
+    def attach(self, entity):
+        "Move an entity's state into a new row."
+        if self.count == self.capacity:
+            self.grow(self.capacity * 2)
+
+        row = self.count
+        self.count += 1
+        self.entities.append(entity)
+
+        expires = 'life_time' in entity.__dict__
+        values = dict((field, entity.__dict__.pop(field, 0)) for field in FIELDS)
+        controls = entity.__dict__.pop('controls')
+
+        entity.world = self
+        entity.row = row
+        entity.__class__ = view_class(entity.__class__)
+        for field, value in values.items():
+            setattr(entity, field, value)
+        self.expires[row] = expires
+        entity.controls = RowControls(entity, controls)
+
+    def detach(self, entity):
+        "Copy an entity's state out of its row and free the row."
+        row = entity.row
+        values = dict((field, getattr(entity, field)) for field in FIELDS)
+        if not self.expires[row]:
+            del values['life_time']
+        controls = entity.controls.copy()
+
+        # Fill the hole with the last row.
+        last = self.count - 1
+        if row != last:
+            moved = self.entities[last]
+            for name, columns, kind in ARRAYS:
+                array = getattr(self, name)
+                array[row] = array[last]
+            self.entities[row] = moved
+            moved.row = row
+        self.entities.pop()
+        self.count = last
+
+        entity.__class__ = entity.__class__.__bases__[1]
+        del entity.world
+        del entity.row
+        entity.__dict__.update(values)
+        entity.controls = controls
+
+    def step(self, delta_time):
+        """
+        Integrate thrust, turning, wrap around and weapon life time for every
+        row. Returns the entities whose life time ran out; they did not move.
+        """
+        n = self.count
+        if not n:
+            return []
+
+        pos = self.pos[:n]
+        vel = self.vel[:n]
+        caps = self.caps[:n]
+        angle = self.angle[:n]
+        old_angle = self.old_angle[:n]
+        life_time = self.life_time[:n]
+        expires = self.expires[:n]
+
+        # Weapons past their life time are removed before they move.
+        expired = expires & (life_time <= 0)
+        dead = [self.entities[i] for i in flatnonzero(expired)]
+        flying = expires & ~expired
+        life_time[flying] -= delta_time
+        vel[flying] = caps[flying]
+
+        accel = self.accel[:n] * delta_time
+        heading = floor(angle * HEADING_SCALE + 0.5).astype(int) % HEADING_STEPS
+        sin_a = SIN_TABLE[heading]
+        cos_a = COS_TABLE[heading]
+
+        # The velocity caps are the first multiple of the acceleration along
+        # the heading that reaches max_speed.
+        turned = angle != old_angle
+        if turned.any():
+            step = fabs(accel[turned]) * (fabs(sin_a[turned]) +
+                                          fabs(cos_a[turned]))
+            with errstate(divide='ignore', invalid='ignore'):
+                steps = ceil(self.max_speed[:n][turned] / step)
+            steps = where(step > 0, maximum(steps, 0), 0)
+            caps[turned, 0] = steps * sin_a[turned] * accel[turned]
+            caps[turned, 1] = steps * cos_a[turned] * accel[turned]
+            old_angle[turned] = angle[turned]
+
+        # Thrust only while the future velocity stays within the caps.
+        thrusting = self.thrust[:n] == 1
+        future_x = vel[:, 0] + sin_a * accel
+        future_y = vel[:, 1] + cos_a * accel
+        cap_x = caps[:, 0]
+        cap_y = caps[:, 1]
+        move_x = thrusting & where(cap_x > 0, future_x < cap_x, future_x > cap_x)
+        move_y = thrusting & where(cap_y > 0, future_y < cap_y, future_y > cap_y)
+        vel[move_x, 0] = future_x[move_x]
+        vel[move_y, 1] = future_y[move_y]
+
+        turning = self.turning[:n]
+        turn_rate = self.turn_rate[:n]
+        vel_angle = self.vel_angle[:n]
+        vel_angle[:] = where(turning == 1, -turn_rate,
+                             where(turning == 2, turn_rate, 0))
+
+        # Move and wrap to the opposite side of the system.
+        if dead:
+            moving = ~expired
+            pos[moving] += vel[moving] * delta_time
+        else:
+            pos += vel * delta_time
+        size = self.system_size
+        pos[pos > size] -= size * 2
+        pos[pos < -size] += size * 2
+
+        angle += vel_angle * delta_time
+        angle[angle < 0] += 360
+        angle[angle > 360] -= 360
+
+        self.speed[:n] = fabs(vel).sum(1)
+        return dead
+
+    def positions(self, entities):
+        "Return [pos_x, pos_y] of entities in this world, read all at once."
+        return self.pos[[e.row for e in entities]].tolist()
+
+    def updates(self):
+        "Return the update data of every row."
+        n = self.count
+        entities = self.entities
+        rows = zip(self.pos[:n].tolist(), self.angle[:n].tolist(),
+                   self.vel[:n].tolist(), self.vel_angle[:n].tolist())
+        updates = []
+        for entity, ((pos_x, pos_y), angle, (vel_x, vel_y), vel_angle) in \
+                zip(entities, rows):
+            updates.append({
+                'object_id': entity.object_id,
+                'type': entity.type,
+                'pos_x': pos_x,
+                'pos_y': pos_y,
+                'angle': angle,
+                'vel_x': vel_x,
+                'vel_y': vel_y,
+                'vel_angle': vel_angle,
+            })
+        return updates